@@ -0,0 +1,1011 @@
+"""Benchmark lokal untuk backend EduTech.
+
+Menjalankan app di dalam proses (tanpa server) dengan database SQLite
+sementara dan model AI palsu, jadi tidak memakai kuota Gemini sama sekali.
+
+Contoh:
+    python benchmark.py llm-load --generations 50 --latency 2
+    python benchmark.py mixed --users 20 --output rilis-baru.json --baseline rilis-lama.json
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+# Harus diset sebelum import main (main membaca .env saat import)
+_tmpdir = tempfile.mkdtemp(prefix="edutech-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+os.environ.setdefault("GOOGLE_API_KEY", "bench-dummy-key")
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+# Limit AI dibuat longgar; skenario "admission" memasang limit ketatnya sendiri
+os.environ.setdefault("LLM_RPM", "100000")
+os.environ.setdefault("LLM_USER_RPM", "100000")
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+import main  # noqa: E402
+
+FAKE_CHAPTER = """{
+    "content_markdown": "# Materi Palsu\\n\\nIsi materi untuk benchmark.",
+    "quizzes": [
+        {"question": "1 + 1?", "options": ["1", "2", "3", "4"], "correct_answer": "2"}
+    ]
+}"""
+
+
+FAKE_CHAPTER_STREAM = """# Materi Palsu
+
+Isi materi untuk benchmark, dikirim sedikit demi sedikit.
+
+| Fitur | Penjelasan |
+|---|---|
+| Streaming | Token pertama cepat sampai |
+
+===KUIS===
+[{"question": "1 + 1?", "options": ["1", "2", "3", "4"], "correct_answer": "2"}]
+"""
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(label, samples):
+    print(
+        f"{label:<28} n={len(samples):<4} "
+        f"p50={percentile(samples, 50) * 1000:8.1f}ms "
+        f"p95={percentile(samples, 95) * 1000:8.1f}ms "
+        f"max={max(samples) * 1000:8.1f}ms "
+        f"mean={statistics.mean(samples) * 1000:8.1f}ms"
+    )
+
+
+@asynccontextmanager
+async def make_client():
+    main.create_schema()
+    # ASGITransport tidak menjalankan lifespan, jadi dijalankan manual di sini
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client
+
+
+@asynccontextmanager
+async def serve_app():
+    """Jalankan uvicorn sungguhan (ASGITransport menahan body sampai selesai)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    main.create_schema()
+    server = uvicorn.Server(uvicorn.Config(main.app, port=port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            yield client
+    finally:
+        server.should_exit = True
+        await serving
+
+
+async def login(client, username, password="rahasia"):
+    await client.post("/register", json={"username": username, "password": password})
+    res = await client.post("/token", data={"username": username, "password": password})
+    return res.json()["access_token"]
+
+
+async def timed(coro_factory, samples):
+    start = time.perf_counter()
+    res = await coro_factory()
+    samples.append(time.perf_counter() - start)
+    return res
+
+
+async def probe_fast_endpoints(client, token, rounds):
+    """Ukur latency /token dan /my-courses secara berurutan."""
+    headers = {"Authorization": f"Bearer {token}"}
+    token_samples, courses_samples = [], []
+    for _ in range(rounds):
+        await timed(
+            lambda: client.post(
+                "/token", data={"username": "bench", "password": "rahasia"}
+            ),
+            token_samples,
+        )
+        await timed(lambda: client.get("/my-courses", headers=headers), courses_samples)
+    return token_samples, courses_samples
+
+
+async def bench_llm_load(args):
+    fake = main.FakeModel(latency=args.latency)
+    main.llm.model = fake
+
+    async with make_client() as client:
+        token = await login(client, "bench")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        idle = await probe_fast_endpoints(client, token, args.rounds)
+
+        generations = [
+            asyncio.create_task(
+                client.post(
+                    "/generate-preview", json={"topic": f"topik {i}"}, headers=headers
+                )
+            )
+            for i in range(args.generations)
+        ]
+        await asyncio.sleep(0.05)
+        loaded = await probe_fast_endpoints(client, token, args.rounds)
+        in_flight = sum(not t.done() for t in generations)
+        await asyncio.gather(*generations)
+
+    print(
+        f"Generasi paralel: {args.generations} (latency palsu {args.latency}s, "
+        f"masih berjalan saat diukur: {in_flight})"
+    )
+    report("/token (idle)", idle[0])
+    report("/token (saat generasi)", loaded[0])
+    report("/my-courses (idle)", idle[1])
+    report("/my-courses (saat generasi)", loaded[1])
+
+
+async def create_course(client, headers, title="Kursus Benchmark"):
+    res = await client.post(
+        "/courses",
+        json={
+            "title": title,
+            "description": "Deskripsi",
+            "chapters": [
+                {"chapter_number": 1, "title": "Bab 1", "summary": "Ringkasan 1"},
+                {"chapter_number": 2, "title": "Bab 2", "summary": "Ringkasan 2"},
+            ],
+        },
+        headers=headers,
+    )
+    return res.json()
+
+
+async def bench_single_flight(args):
+    fake = main.FakeModel(latency=args.latency, text=FAKE_CHAPTER)
+    main.llm.model = fake
+
+    async with make_client() as client:
+        token = await login(client, "bench")
+        headers = {"Authorization": f"Bearer {token}"}
+        await create_course(client, headers)
+        courses = (await client.get("/my-courses", headers=headers)).json()
+        chapter_id = courses[-1]["chapters"][0]["id"]
+
+        samples = []
+        responses = await asyncio.gather(
+            *[
+                timed(
+                    lambda: client.get(f"/chapters/{chapter_id}/content", headers=headers),
+                    samples,
+                )
+                for _ in range(args.requests)
+            ]
+        )
+
+    bodies = {r.text for r in responses}
+    print(
+        f"{args.requests} request paralel ke chapter {chapter_id}: "
+        f"model dipanggil {fake.calls}x, status {sorted({r.status_code for r in responses})}, "
+        f"{len(bodies)} variasi konten"
+    )
+    report("/chapters/{id}/content", samples)
+    if fake.calls != 1:
+        raise SystemExit("GAGAL: model harus dipanggil tepat satu kali")
+
+
+async def wait_prefetch_idle(client, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        stats = (await client.get("/prefetch/status")).json()
+        if stats["queue_depth"] == 0 and stats["in_progress"] == 0:
+            return
+        await asyncio.sleep(0.05)
+    raise SystemExit("GAGAL: antrian prefetch tidak kosong")
+
+
+async def bench_prefetch(args):
+    fake = main.FakeModel(latency=args.latency, text=FAKE_CHAPTER)
+    main.llm.model = fake
+
+    async with make_client() as client:
+        token = await login(client, "bench")
+        headers = {"Authorization": f"Bearer {token}"}
+        await create_course(client, headers)
+        chapters = (await client.get("/my-courses", headers=headers)).json()[-1]["chapters"]
+
+        samples = []
+        await wait_prefetch_idle(client)
+        await timed(
+            lambda: client.get(f"/chapters/{chapters[0]['id']}/content", headers=headers),
+            samples,
+        )
+        await client.put(f"/chapters/{chapters[0]['id']}/complete", headers=headers)
+        await wait_prefetch_idle(client)
+        await timed(
+            lambda: client.get(f"/chapters/{chapters[1]['id']}/content", headers=headers),
+            samples,
+        )
+
+    print(f"Model dipanggil {fake.calls}x (latency palsu {args.latency}s)")
+    report("buka chapter (prefetched)", samples)
+
+
+class QueryCounter:
+    """Hitung query SQL yang dieksekusi lewat ``main.engine``."""
+
+    def __init__(self):
+        self.count = 0
+        event.listen(main.engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def seed_courses(username, courses, chapters, blob_kb):
+    """Isi DB langsung (tanpa endpoint) dengan kursus yang kontennya sudah digenerate."""
+    db = main.SessionLocal()
+    try:
+        user = db.query(main.User).filter(main.User.username == username).first()
+        blob = '{"content_markdown": "' + "x" * (blob_kb * 1024) + '", "quizzes": []}'
+        for i in range(courses):
+            course = main.Course(
+                title=f"Kursus {i}", description="Deskripsi", user_id=user.id
+            )
+            course.chapters = [
+                main.Chapter(
+                    chapter_number=n + 1,
+                    title=f"Bab {n + 1}",
+                    summary="Ringkasan " * 50,
+                    is_locked=n > 0,
+                    content_json=blob,
+                )
+                for n in range(chapters)
+            ]
+            db.add(course)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def bench_my_courses(args):
+    async with make_client() as client:
+        token = await login(client, "bench")
+        headers = {"Authorization": f"Bearer {token}"}
+        seed_courses("bench", args.courses, args.chapters, args.blob_kb)
+
+        counter = QueryCounter()
+        samples = []
+        for _ in range(args.rounds):
+            res = await timed(lambda: client.get("/my-courses", headers=headers), samples)
+        queries = counter.count / args.rounds
+
+    print(
+        f"{args.courses} kursus x {args.chapters} chapter (konten {args.blob_kb} KB): "
+        f"{queries:.0f} query/request, respons {len(res.content) / 1024:.1f} KB"
+    )
+    report("/my-courses", samples)
+
+
+MARKDOWN_BLOCK = """## Variabel itu Ibarat Wadah Makanan
+
+Bayangkan kamu punya **kotak bekal**. Kotak itu bisa diisi nasi, lauk, atau buah.
+Di Python, `variabel` juga begitu: tempat menyimpan nilai yang bisa diganti-ganti.
+
+| Tipe Data | Contoh | Penjelasan |
+|---|---|---|
+| `int` | `umur = 17` | Bilangan bulat |
+| `str` | `nama = "Budi"` | Teks |
+| `bool` | `aktif = True` | Benar/salah |
+
+- Nama variabel sebaiknya *deskriptif*
+- Hindari nama satu huruf kecuali untuk indeks
+
+```python
+keranjang = ["apel", "jeruk"]
+keranjang.append("mangga")
+print(keranjang)
+```
+
+"""
+
+
+def make_chapter_json(size_kb):
+    markdown = ""
+    while len(markdown) < size_kb * 1024:
+        markdown += MARKDOWN_BLOCK
+    quiz = {"question": "Apa itu variabel?", "options": ["A", "B", "C", "D"], "correct_answer": "A"}
+    return json.dumps({"content_markdown": markdown, "quizzes": [quiz] * 3})
+
+
+def cpu_per_call(func, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations
+
+
+async def bench_chapter_read(args):
+    async with make_client() as client:
+        token = await login(client, "bench")
+        headers = {"Authorization": f"Bearer {token}"}
+        await create_course(client, headers)
+        chapter_id = (await client.get("/my-courses", headers=headers)).json()[-1][
+            "chapters"
+        ][0]["id"]
+
+        for size_kb in args.sizes:
+            content_json = make_chapter_json(size_kb)
+            db = main.SessionLocal()
+            db.query(main.Chapter).filter(main.Chapter.id == chapter_id).update(
+                main.encode_chapter_content(content_json), synchronize_session=False
+            )
+            db.commit()
+            db.close()
+
+            # Jalur lama: json.loads -> jsonable_encoder -> json.dumps
+            legacy = cpu_per_call(
+                lambda: JSONResponse(jsonable_encoder(json.loads(content_json))).body,
+                args.iterations,
+            )
+            raw = cpu_per_call(lambda: content_json.encode(), args.iterations)
+            gz_size = len(gzip.compress(content_json.encode(), 9))
+            print(
+                f"\n{size_kb} KB (gzip {gz_size / 1024:.1f} KB): "
+                f"encode lama {legacy * 1e6:.0f}us/req, bytes mentah {raw * 1e6:.1f}us/req, "
+                f"hemat {(legacy - raw) * 1e6:.0f}us CPU/req"
+            )
+            for encoding in ("identity", "gzip", "br"):
+                samples = []
+                for _ in range(args.rounds):
+                    await timed(
+                        lambda: client.get(
+                            f"/chapters/{chapter_id}/content",
+                            headers={**headers, "Accept-Encoding": encoding},
+                        ),
+                        samples,
+                    )
+                report(f"  content ({encoding})", samples)
+
+
+async def first_event_latency(client, url, headers, disconnect_after_first=False):
+    """Return (detik sampai delta pertama, detik sampai selesai, jumlah event)."""
+    start = time.perf_counter()
+    first = None
+    events = 0
+    async with client.stream("GET", url, headers=headers) as res:
+        async for line in res.aiter_lines():
+            if not line.startswith("event:"):
+                continue
+            events += 1
+            if first is None:
+                first = time.perf_counter() - start
+                if disconnect_after_first:
+                    break
+    return first, time.perf_counter() - start, events
+
+
+async def bench_stream(args):
+    fake = main.FakeModel(
+        latency=args.latency, text=FAKE_CHAPTER, stream_text=FAKE_CHAPTER_STREAM
+    )
+    main.llm.model = fake
+    # Tanpa prefetch, supaya hitungan panggilan model hanya dari skenario ini
+    main.chapter_prefetcher.workers = 0
+
+    async with serve_app() as client:
+        token = await login(client, "bench")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        chapter_ids = []
+        # Judul berbeda supaya tidak dilayani dari cache LLM
+        for i in range(3):
+            await create_course(client, headers, title=f"Kursus Stream {i}")
+            course = (await client.get("/my-courses", headers=headers)).json()[-1]
+            chapter_ids.append(course["chapters"][1]["id"])
+
+        blocking = []
+        await timed(
+            lambda: client.get(f"/chapters/{chapter_ids[0]}/content", headers=headers),
+            blocking,
+        )
+        first, total, events = await first_event_latency(
+            client, f"/chapters/{chapter_ids[1]}/content/stream", headers
+        )
+        await first_event_latency(
+            client,
+            f"/chapters/{chapter_ids[2]}/content/stream",
+            headers,
+            disconnect_after_first=True,
+        )
+        # Generasi harus tetap tersimpan di DB walau client sudah putus
+        await asyncio.sleep(args.latency + 0.5)
+        db = main.SessionLocal()
+        stored = db.get(main.Chapter, chapter_ids[2]).content_json
+        db.close()
+
+    print(f"Latency palsu {args.latency}s, model dipanggil {fake.calls}x")
+    print(f"GET content (tanpa stream): {blocking[0] * 1000:8.1f}ms sampai byte pertama")
+    print(
+        f"GET content/stream        : {first * 1000:8.1f}ms sampai delta pertama, "
+        f"{total * 1000:.1f}ms total, {events} event"
+    )
+    persisted = stored is not None and "Materi Palsu" in stored
+    print(f"Client putus di tengah stream -> konten tetap tersimpan: {persisted}")
+    if fake.calls != 3 or not persisted:
+        raise SystemExit("GAGAL: generasi yang putus harus tetap tersimpan tanpa generate ulang")
+
+
+async def bench_llm_cache(args):
+    fake = main.FakeModel(latency=args.latency)
+    main.llm.model = fake
+    topics = ["Python dasar", "python  Dasar ", "Belajar SQL", "belajar sql"]
+
+    async with make_client() as client:
+        samples = {"miss": [], "hit": []}
+        for user in range(args.users):
+            token = await login(client, f"bench{user}")
+            headers = {"Authorization": f"Bearer {token}"}
+            for topic in topics:
+                before = fake.calls
+                start = time.perf_counter()
+                await client.post(
+                    "/generate-preview", json={"topic": topic}, headers=headers
+                )
+                kind = "miss" if fake.calls > before else "hit"
+                samples[kind].append(time.perf_counter() - start)
+        stats = (await client.get("/llm-cache/status")).json()
+
+    requests = args.users * len(topics)
+    print(f"{requests} preview dari {args.users} user, model dipanggil {fake.calls}x")
+    print(f"Cache: {stats}")
+    report("preview (miss)", samples["miss"])
+    report("preview (hit)", samples["hit"])
+
+
+def use_admission(**overrides):
+    options = dict(
+        store=main.MemoryBucketStore(),
+        rpm=100000,
+        tpm=10**9,
+        user_rpm=100000,
+        max_waiters=100,
+        max_wait=30.0,
+        breaker=main.CircuitBreaker(threshold=3, cooldown=30.0),
+    )
+    options.update(overrides)
+    controller = main.AdmissionController(**options)
+    main.llm.admission = main.admission = controller
+    return controller
+
+
+async def preview(client, headers, topic):
+    return await client.post(
+        "/generate-preview", params={"fresh": "true"}, json={"topic": topic}, headers=headers
+    )
+
+
+async def bench_admission(args):
+    fake = main.FakeModel(latency=0.05)
+    main.llm.model = fake
+
+    async with make_client() as client:
+        tokens = [await login(client, name) for name in ("spammer", "sopan")]
+        spammer, polite = ({"Authorization": f"Bearer {t}"} for t in tokens)
+
+        # 1. Bucket per user: kelebihan langsung ditolak dengan Retry-After
+        use_admission(user_rpm=args.user_rpm)
+        results = [await preview(client, spammer, "spam") for _ in range(args.user_rpm * 3)]
+        rejected = [r for r in results if r.status_code == 429]
+        print(
+            f"[per-user] {len(results)} request, {len(results) - len(rejected)} lolos, "
+            f"{len(rejected)} ditolak (Retry-After={rejected[0].headers.get('retry-after')}s)"
+        )
+
+        # 2. Bucket global kosong: antrian round-robin antar user
+        controller = use_admission(rpm=args.rpm)
+        # Habiskan kapasitas burst supaya semua request harus antri
+        controller.store.take_all(
+            [main.BucketSpec("global:rpm", args.rpm, args.rpm, args.rpm / 60)]
+        )
+        latencies = {"spammer": [], "sopan": []}
+
+        async def send(name, headers, delay):
+            await asyncio.sleep(delay)
+            await timed(lambda: preview(client, headers, name), latencies[name])
+
+        await asyncio.gather(
+            *[send("spammer", spammer, 0) for _ in range(args.burst)],
+            *[send("sopan", polite, 0.05) for _ in range(3)],
+        )
+        print(f"[antrian] global {args.rpm} RPM, spammer kirim {args.burst}, user lain 3:")
+        report("  spammer", latencies["spammer"])
+        report("  user lain (round-robin)", latencies["sopan"])
+
+        # 3. Circuit breaker: setelah ResourceExhausted berulang, gagal cepat
+        use_admission()
+
+        exhausted = main.FakeModel(latency=0, exhausted_every=1)
+        main.llm.model = exhausted
+        statuses = [(await preview(client, polite, "quota")).status_code for _ in range(10)]
+        stats = (await client.get("/llm-admission/status")).json()
+        print(
+            f"[breaker] 10 request saat kuota habis: status {sorted(set(statuses))}, "
+            f"model dipanggil {exhausted.calls}x, breaker {stats['breaker']}"
+        )
+
+
+async def throughput(client, path, headers, total, concurrency):
+    """Return (request/detik, sampel latency) untuk ``total`` GET paralel."""
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            res = await timed(lambda: client.get(path, headers=headers), samples)
+            assert res.status_code == 200, res.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(total)])
+    return total / (time.perf_counter() - start), samples
+
+
+async def bench_auth(args):
+    async with make_client() as client:
+        token = await login(client, "bench")
+        headers = {"Authorization": f"Bearer {token}"}
+        await create_course(client, headers)
+        path = f"/courses/{(await client.get('/my-courses', headers=headers)).json()[-1]['id']}"
+
+        counter = QueryCounter()
+        for label, ttl in (("tanpa cache user", 0), ("cache user", 60)):
+            main.user_cache = main.UserCache(ttl, main.USER_CACHE_MAX_ITEMS)
+            counter.count = 0
+            rps, samples = await throughput(
+                client, path, headers, args.requests, args.concurrency
+            )
+            print(
+                f"{label:<18} {rps:7.0f} req/s, "
+                f"{counter.count / args.requests:.2f} query/request"
+            )
+            report(f"  GET {path}", samples)
+
+        for rounds in args.rounds:
+            context = main.pwd_context.copy(bcrypt__rounds=rounds)
+            start = time.perf_counter()
+            context.hash("rahasia")
+            print(f"bcrypt rounds={rounds:<3} hash {(time.perf_counter() - start) * 1000:7.1f}ms")
+
+
+async def bench_save_course(args):
+    main.chapter_prefetcher.workers = 0
+    async with make_client() as client:
+        token = await login(client, "bench")
+        headers = {"Authorization": f"Bearer {token}"}
+        payload = {
+            "title": "Kursus Benchmark",
+            "description": "Deskripsi",
+            "chapters": [
+                {"chapter_number": n + 1, "title": f"Bab {n + 1}", "summary": "Ringkasan"}
+                for n in range(args.chapters)
+            ],
+        }
+
+        counter = QueryCounter()
+        save_samples = []
+        for _ in range(args.courses):
+            await timed(lambda: client.post("/courses", json=payload, headers=headers), save_samples)
+        save_queries = counter.count / args.courses
+
+        course = (await client.get("/my-courses", headers=headers)).json()[-1]
+        counter.count = 0
+        complete_samples = []
+        for chapter in course["chapters"]:
+            await timed(
+                lambda: client.put(f"/chapters/{chapter['id']}/complete", headers=headers),
+                complete_samples,
+            )
+        complete_queries = counter.count / len(course["chapters"])
+
+    print(f"{args.courses} course x {args.chapters} chapter")
+    print(f"POST /courses      {save_queries:.1f} query/request")
+    report("  POST /courses", save_samples)
+    print(f"PUT .../complete   {complete_queries:.1f} query/request")
+    report("  PUT .../complete", complete_samples)
+
+
+FAKE_QUIZZES = """[
+    {"question": "2 + 2?", "options": ["2", "3", "4", "5"], "correct_answer": "4"}
+]"""
+
+
+class FlakyChapterModel(main.FakeModel):
+    """Model palsu yang sesekali merusak output JSON chapter.
+
+    Setiap ``broken_quiz_every`` generasi chapter kuisnya tidak valid dan
+    setiap ``truncated_every`` generasi JSON-nya terpotong. Permintaan kuis
+    saja (skema ``list[QuizItem]``) selalu dijawab dengan benar.
+    """
+
+    def __init__(self, latency, broken_quiz_every, truncated_every):
+        super().__init__(latency, text=FAKE_CHAPTER)
+        self.broken_quiz_every = broken_quiz_every
+        self.truncated_every = truncated_every
+        self.chapter_calls = 0
+        self.quiz_calls = 0
+        self.generated_chars = 0
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        config = kwargs.get("generation_config")
+        if config is not None and config["response_schema"] is not main.ChapterContent:
+            self.quiz_calls += 1
+            text = FAKE_QUIZZES
+        else:
+            self.chapter_calls += 1
+            text = self.text
+            if self.chapter_calls % self.truncated_every == 0:
+                text = text[: len(text) // 2]
+            elif self.chapter_calls % self.broken_quiz_every == 0:
+                text = text.replace('"correct_answer": "2"', '"jawaban": "2"')
+        # Latency sebanding dengan panjang output
+        await asyncio.sleep(self.latency * len(text) / len(self.text))
+        self.generated_chars += len(text)
+        return main.FakeResponse(text)
+
+
+async def bench_structured(args):
+    main.chapter_prefetcher.workers = 0
+    fake = FlakyChapterModel(args.latency, args.broken_quiz_every, args.truncated_every)
+    main.llm.model = fake
+
+    async with make_client() as client:
+        token = await login(client, "bench")
+        headers = {"Authorization": f"Bearer {token}"}
+        for n in range(args.courses):
+            await create_course(client, headers, title=f"Kursus Struktur {n}")
+        courses = (await client.get("/my-courses", headers=headers)).json()
+        chapter_ids = [chapter["id"] for course in courses for chapter in course["chapters"]]
+
+        samples = []
+        responses = []
+        for chapter_id in chapter_ids:
+            responses.append(
+                await timed(
+                    lambda: client.get(f"/chapters/{chapter_id}/content", headers=headers),
+                    samples,
+                )
+            )
+        stats = (await client.get("/llm-generation/status")).json()
+
+    failed = [r.status_code for r in responses if r.status_code != 200]
+    # Tanpa perbaikan parsial, setiap chapter dengan kuis rusak dibuat ulang penuh
+    full_retry_chars = fake.generated_chars + stats["partial_repairs"] * (
+        len(FAKE_CHAPTER) - len(FAKE_QUIZZES)
+    )
+    print(
+        f"{len(chapter_ids)} chapter: {fake.chapter_calls} generasi chapter, "
+        f"{fake.quiz_calls} generasi kuis saja, {len(failed)} gagal"
+    )
+    print(f"Statistik: {stats}")
+    print(
+        f"Output AI {fake.generated_chars} karakter "
+        f"(vs {full_retry_chars} jika kuis rusak dibuat ulang penuh)"
+    )
+    report("/chapters/{id}/content", samples)
+    if failed:
+        raise SystemExit(f"GAGAL: status {failed}")
+
+
+STARTUP_PROBE = """
+import asyncio, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def ready():
+    async with main.app.router.lifespan_context(main.app):
+        print(imported - started, time.perf_counter() - started)
+
+asyncio.run(ready())
+"""
+
+
+def bench_startup_sync(args):
+    samples = {"import": [], "siap": []}
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", STARTUP_PROBE],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        samples["import"].append(float(output[0]))
+        samples["siap"].append(float(output[1]))
+    report("import main", samples["import"])
+    report("import + lifespan", samples["siap"])
+
+
+async def bench_startup(args):
+    await asyncio.to_thread(bench_startup_sync, args)
+
+
+MIXED_TOPICS = ["Python dasar", "Belajar SQL", "Git untuk pemula", "Dasar JavaScript"]
+
+
+class TrafficRecorder:
+    """Latency dan jumlah error per endpoint (method, template route)."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, method, route, send):
+        start = time.perf_counter()
+        res = await send
+        self.samples[(method, route)].append(time.perf_counter() - start)
+        if res.status_code >= 400:
+            self.errors[(method, route)] += 1
+        return res
+
+
+async def mixed_session(client, recorder, user, args):
+    """Satu user: daftar, login, lalu berulang kali buat kursus dan belajar."""
+    credentials = {"username": f"mixed{user}", "password": "rahasia"}
+    await recorder.call("POST", "/register", client.post("/register", json=credentials))
+    res = await recorder.call("POST", "/token", client.post("/token", data=credentials))
+    headers = {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+    for i in range(args.iterations):
+        topic = MIXED_TOPICS[(user + i) % len(MIXED_TOPICS)]
+        res = await recorder.call(
+            "POST",
+            "/generate-preview",
+            client.post("/generate-preview", json={"topic": topic}, headers=headers),
+        )
+        if res.status_code != 200:
+            # Mis. 429 dari ResourceExhausted yang disuntikkan: user coba lagi nanti
+            await asyncio.sleep(args.think)
+            continue
+        course = await recorder.call(
+            "POST", "/courses", client.post("/courses", json=res.json(), headers=headers)
+        )
+        course_id = course.json()["id"]
+        courses = await recorder.call(
+            "GET", "/my-courses", client.get("/my-courses", headers=headers)
+        )
+        await recorder.call(
+            "GET",
+            "/courses/{course_id}",
+            client.get(f"/courses/{course_id}", headers=headers),
+        )
+        chapters = next(c for c in courses.json() if c["id"] == course_id)["chapters"]
+        for chapter in chapters[: args.chapters]:
+            await recorder.call(
+                "GET",
+                "/chapters/{chapter_id}/content",
+                client.get(f"/chapters/{chapter['id']}/content", headers=headers),
+            )
+            await recorder.call(
+                "PUT",
+                "/chapters/{chapter_id}/complete",
+                client.put(f"/chapters/{chapter['id']}/complete", headers=headers),
+            )
+        await asyncio.sleep(args.think)
+
+
+def compare_with_baseline(results, path):
+    with open(path) as f:
+        baseline = json.load(f)["endpoints"]
+    print(f"Dibanding baseline {path}:")
+    for endpoint, current in results["endpoints"].items():
+        before = baseline.get(endpoint)
+        if before is None:
+            continue
+        change = (current["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        print(
+            f"  {endpoint:<36} p95 {before['p95_ms']:8.1f} -> {current['p95_ms']:8.1f}ms "
+            f"({change:+.0f}%), query {before['queries_per_request']:.1f} -> "
+            f"{current['queries_per_request']:.1f}"
+        )
+
+
+def histogram_totals(histogram):
+    """(sum, count) per kombinasi label (method, route) dari histogram Prometheus."""
+    totals = defaultdict(lambda: [0.0, 0])
+    for family in histogram.collect():
+        for sample in family.samples:
+            key = (sample.labels["method"], sample.labels["route"])
+            if sample.name.endswith("_sum"):
+                totals[key][0] = sample.value
+            elif sample.name.endswith("_count"):
+                totals[key][1] = sample.value
+    return totals
+
+
+async def bench_mixed(args):
+    fake = main.FakeModel(latency=args.latency, exhausted_every=args.exhausted_every)
+    main.llm.model = fake
+    recorder = TrafficRecorder()
+
+    async with make_client() as client:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[mixed_session(client, recorder, user, args) for user in range(args.users)]
+        )
+        elapsed = time.perf_counter() - start
+    # Jumlah query per request dari instrumentasi engine di main (/metrics)
+    queries = histogram_totals(main.http_request_queries)
+
+    total = sum(len(samples) for samples in recorder.samples.values())
+    results = {"requests": total, "seconds": elapsed, "throughput": total / elapsed}
+    results["endpoints"] = {}
+    for (method, route), samples in sorted(recorder.samples.items(), key=lambda i: i[0][1]):
+        query_sum, query_count = queries.get((method, route), (0, 0))
+        results["endpoints"][f"{method} {route}"] = {
+            "requests": len(samples),
+            "errors": recorder.errors[(method, route)],
+            "throughput": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+            "queries_per_request": query_sum / query_count if query_count else 0.0,
+        }
+
+    print(
+        f"{args.users} user x {args.iterations} iterasi: {total} request dalam "
+        f"{elapsed:.1f}s ({results['throughput']:.0f} req/s), model dipanggil {fake.calls}x"
+    )
+    print(
+        f"{'endpoint':<38}{'n':>6}{'error':>7}{'req/s':>8}"
+        f"{'p50':>10}{'p95':>10}{'p99':>10}{'query':>7}"
+    )
+    for endpoint, row in results["endpoints"].items():
+        print(
+            f"{endpoint:<38}{row['requests']:>6}{row['errors']:>7}{row['throughput']:>8.1f}"
+            f"{row['p50_ms']:>8.1f}ms{row['p95_ms']:>8.1f}ms{row['p99_ms']:>8.1f}ms"
+            f"{row['queries_per_request']:>7.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Hasil disimpan ke {args.output}")
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    llm_load = sub.add_parser(
+        "llm-load", help="Latency endpoint ringan saat banyak generasi AI berjalan"
+    )
+    llm_load.add_argument("--generations", type=int, default=50)
+    llm_load.add_argument("--latency", type=float, default=2.0)
+    llm_load.add_argument("--rounds", type=int, default=10)
+    llm_load.set_defaults(func=bench_llm_load)
+
+    single_flight = sub.add_parser(
+        "single-flight", help="Request paralel ke chapter yang sama -> 1 panggilan AI"
+    )
+    single_flight.add_argument("--requests", type=int, default=20)
+    single_flight.add_argument("--latency", type=float, default=1.0)
+    single_flight.set_defaults(func=bench_single_flight)
+
+    prefetch = sub.add_parser(
+        "prefetch", help="Buka chapter yang sudah di-prefetch -> murni baca DB"
+    )
+    prefetch.add_argument("--latency", type=float, default=1.0)
+    prefetch.set_defaults(func=bench_prefetch)
+
+    my_courses = sub.add_parser(
+        "my-courses", help="Jumlah query dan latency /my-courses untuk user berat"
+    )
+    my_courses.add_argument("--courses", type=int, default=300)
+    my_courses.add_argument("--chapters", type=int, default=5)
+    my_courses.add_argument("--blob-kb", type=int, default=20)
+    my_courses.add_argument("--rounds", type=int, default=20)
+    my_courses.set_defaults(func=bench_my_courses)
+
+    chapter_read = sub.add_parser(
+        "chapter-read", help="CPU & latency baca konten chapter yang sudah tersimpan"
+    )
+    chapter_read.add_argument("--sizes", type=int, nargs="+", default=[10, 30, 50])
+    chapter_read.add_argument("--iterations", type=int, default=500)
+    chapter_read.add_argument("--rounds", type=int, default=50)
+    chapter_read.set_defaults(func=bench_chapter_read)
+
+    stream = sub.add_parser(
+        "stream", help="Waktu sampai delta pertama pada endpoint SSE"
+    )
+    stream.add_argument("--latency", type=float, default=2.0)
+    stream.set_defaults(func=bench_stream)
+
+    llm_cache = sub.add_parser(
+        "llm-cache", help="Topik populer dari banyak user dilayani dari cache"
+    )
+    llm_cache.add_argument("--users", type=int, default=5)
+    llm_cache.add_argument("--latency", type=float, default=1.0)
+    llm_cache.set_defaults(func=bench_llm_cache)
+
+    admission_parser = sub.add_parser(
+        "admission", help="Rate limit per user, antrian adil, dan circuit breaker"
+    )
+    admission_parser.add_argument("--user-rpm", type=int, default=5)
+    admission_parser.add_argument("--rpm", type=int, default=600)
+    admission_parser.add_argument("--burst", type=int, default=20)
+    admission_parser.set_defaults(func=bench_admission)
+
+    auth = sub.add_parser(
+        "auth", help="Throughput request terautentikasi dan biaya bcrypt"
+    )
+    auth.add_argument("--requests", type=int, default=500)
+    auth.add_argument("--concurrency", type=int, default=20)
+    auth.add_argument("--rounds", type=int, nargs="+", default=[10, 12])
+    auth.set_defaults(func=bench_auth)
+
+    save_course = sub.add_parser(
+        "save-course", help="Biaya simpan course dan menyelesaikan chapter"
+    )
+    save_course.add_argument("--courses", type=int, default=200)
+    save_course.add_argument("--chapters", type=int, default=5)
+    save_course.set_defaults(func=bench_save_course)
+
+    structured = sub.add_parser(
+        "structured", help="Output JSON rusak diperbaiki sebagian, bukan diulang penuh"
+    )
+    structured.add_argument("--courses", type=int, default=30)
+    structured.add_argument("--latency", type=float, default=0.2)
+    structured.add_argument("--broken-quiz-every", type=int, default=3)
+    structured.add_argument("--truncated-every", type=int, default=10)
+    structured.set_defaults(func=bench_structured)
+
+    startup = sub.add_parser(
+        "startup", help="Waktu import dan startup satu worker (proses baru)"
+    )
+    startup.add_argument("--runs", type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    mixed = sub.add_parser(
+        "mixed", help="Trafik campuran realistis: throughput, p50/p95/p99, query/endpoint"
+    )
+    mixed.add_argument("--users", type=int, default=20)
+    mixed.add_argument("--iterations", type=int, default=3)
+    mixed.add_argument("--chapters", type=int, default=2, help="chapter dibuka per kursus")
+    mixed.add_argument("--latency", type=float, default=0.5, help="latency model palsu")
+    mixed.add_argument("--exhausted-every", type=int, default=0)
+    mixed.add_argument("--think", type=float, default=0.0, help="jeda antar iterasi")
+    mixed.add_argument("--output", help="simpan hasil (JSON) untuk dibandingkan nanti")
+    mixed.add_argument("--baseline", help="hasil JSON rilis sebelumnya")
+    mixed.set_defaults(func=bench_mixed)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,21 +1,75 @@
+import asyncio
+import gzip
+import hashlib
 import json
+import math
 import os
-from typing import List, Optional
+import sys
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, Dict, List, Optional, Protocol
 
-import google.generativeai as genai
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
+try:
+    import brotli  # opsional: pip install brotli
+except ImportError:
+    brotli = None
+
 # --- IMPORT BARU UNTUK HANDLE ERROR KUOTA ---
 from google.api_core.exceptions import ResourceExhausted
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from pydantic import BaseModel
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, create_engine
-from sqlalchemy.orm import Session, declarative_base, relationship, sessionmaker
+from prometheus_client import (
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pydantic import BaseModel, ConfigDict, ValidationError
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    and_,
+    case,
+    create_engine,
+    event,
+    insert,
+    inspect,
+    update,
+)
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import (
+    Session,
+    aliased,
+    declarative_base,
+    load_only,
+    relationship,
+    selectinload,
+    sessionmaker,
+)
 
 # Load environment variables dari file .env
 load_dotenv()
@@ -26,19 +80,872 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 SECRET_KEY = os.getenv("SECRET_KEY")  # Fallback jika tidak ada
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", str(24 * 60)))
+# Cost bcrypt (2^rounds iterasi); turunkan hanya jika CPU server lemah
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Thread khusus bcrypt, terpisah dari threadpool endpoint sync
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+# Berapa lama user hasil decode token dipercaya tanpa cek ulang ke DB
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+# Jumlah user maksimal di cache itu (LRU), supaya memori worker tidak tumbuh terus
+USER_CACHE_MAX_ITEMS = int(os.getenv("USER_CACHE_MAX_ITEMS", "10000"))
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
+# "gemini", atau "fake" untuk model palsu deterministik (benchmark/load test tanpa kuota)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "1"))
+# Setiap panggilan ke-N ke model palsu gagal dengan ResourceExhausted (0 = tidak pernah)
+FAKE_LLM_EXHAUSTED_EVERY = int(os.getenv("FAKE_LLM_EXHAUSTED_EVERY", "0"))
+
+# Batas waktu per panggilan AI (detik) dan jumlah panggilan AI yang boleh jalan bersamaan
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# Admission control sebelum panggilan AI: token bucket global (sesuai limit
+# RPM/TPM model) dan per user, antrian tunggu terbatas, dan circuit breaker
+LLM_RPM = int(os.getenv("LLM_RPM", "60"))
+LLM_TPM = int(os.getenv("LLM_TPM", "1000000"))
+LLM_USER_RPM = int(os.getenv("LLM_USER_RPM", "10"))
+LLM_RESPONSE_TOKENS_ESTIMATE = int(os.getenv("LLM_RESPONSE_TOKENS_ESTIMATE", "2048"))
+LLM_QUEUE_MAX_WAITERS = int(os.getenv("LLM_QUEUE_MAX_WAITERS", "50"))
+LLM_QUEUE_MAX_WAIT_SECONDS = float(os.getenv("LLM_QUEUE_MAX_WAIT_SECONDS", "20"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "3"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "60"))
+# "memory" untuk satu worker, "db" agar bucket dibagi antar worker
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+# Klaim generasi chapter dianggap basi kalau tidak diperbarui selama sekian
+# detik (worker mati/hang); worker yang masih hidup memperbaruinya tiap TTL/3
+CHAPTER_CLAIM_TTL_SECONDS = float(os.getenv("CHAPTER_CLAIM_TTL_SECONDS", "180"))
+CHAPTER_CLAIM_POLL_SECONDS = 0.5
+
+# Pre-generate konten chapter di background (0 worker = nonaktif)
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+PREFETCH_MAX_RETRIES = int(os.getenv("PREFETCH_MAX_RETRIES", "5"))
+PREFETCH_BACKOFF_SECONDS = float(os.getenv("PREFETCH_BACKOFF_SECONDS", "5"))
+
+# Cache respons AI lintas user (in-process LRU di depan tabel llm_cache)
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "256"))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "10000"))
+
+# Total panggilan penuh ke AI per respons kalau JSON-nya rusak total
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "2"))
+
+# Log request yang lebih lambat dari ini beserta SQL-nya (0 = nonaktif)
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
+# Untuk uvicorn multi-worker set PROMETHEUS_MULTIPROC_DIR (folder kosong, dibaca
+# prometheus_client saat import) supaya /metrics menjumlahkan semua worker
+
+# Pool koneksi DB per worker: total koneksi maksimal adalah
+# jumlah worker x (DB_POOL_SIZE + DB_MAX_OVERFLOW), jaga di bawah max_connections DB
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Tutup koneksi yang lebih tua dari ini (detik), sebelum diputus server/proxy DB
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Cek koneksi sebelum dipakai, supaya koneksi mati setelah DB restart tidak bikin 500
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+# --- METRICS ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+
+http_requests = Counter(
+    "http_requests_total", "Jumlah request HTTP", ("method", "route", "status")
+)
+http_request_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Latency request HTTP",
+    ("method", "route"),
+    buckets=LATENCY_BUCKETS,
+)
+http_request_queries = Histogram(
+    "http_request_db_queries",
+    "Jumlah query SQL per request",
+    ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS,
+)
+http_request_db_seconds = Histogram(
+    "http_request_db_seconds",
+    "Total waktu SQL per request",
+    ("method", "route"),
+    buckets=LATENCY_BUCKETS,
+)
+db_queries = Counter("db_queries_total", "Jumlah query SQL (semua sumber)")
+db_query_seconds = Histogram(
+    "db_query_duration_seconds", "Latency per query SQL", buckets=LATENCY_BUCKETS
+)
+llm_requests = Counter(
+    "llm_requests_total", "Panggilan model AI per hasil", ("kind", "outcome")
+)
+llm_request_seconds = Histogram(
+    "llm_request_duration_seconds",
+    "Latency panggilan model AI",
+    ("kind",),
+    buckets=LATENCY_BUCKETS,
+)
+llm_admission_seconds = Histogram(
+    "llm_admission_wait_seconds",
+    "Waktu tunggu admission sebelum panggilan AI",
+    buckets=LATENCY_BUCKETS,
+)
+llm_tokens = Counter(
+    "llm_tokens_total", "Token prompt/respons model AI", ("kind", "direction")
+)
+
+
+class StatsCollector:
+    """Nilai yang dibaca saat scrape dari ``stats()`` komponen lain.
+
+    Nilainya milik worker yang melayani scrape (state in-process), juga
+    dalam mode multiprocess.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def callback(self, name: str, type: str, help: str, func: Callable[[], float]):
+        self._metrics.append((name, type, help, func))
+
+    def describe(self):
+        # Jangan panggil callback saat register (komponennya mungkin belum siap)
+        return []
+
+    def collect(self):
+        for name, type, help, func in self._metrics:
+            family = CounterMetricFamily if type == "counter" else GaugeMetricFamily
+            yield family(name, help, value=float(func()))
+
+
+component_metrics = StatsCollector()
+REGISTRY.register(component_metrics)
+
+
+def render_metrics() -> bytes:
+    """Format teks Prometheus; gabungan semua worker jika PROMETHEUS_MULTIPROC_DIR diset."""
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(component_metrics)
+    return generate_latest(registry)
+
+
+class RequestStats:
+    """Query SQL yang dijalankan selama satu request."""
+
+    __slots__ = ("queries", "db_seconds", "statements")
+
+    def __init__(self, record_statements: bool):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements: Optional[list] = [] if record_statements else None
+
+
+# Ikut tersalin ke threadpool (endpoint sync) dan task yang dibuat dalam request
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def instrument_engine(engine):
+    """Hitung query dan waktunya, total maupun per request yang sedang berjalan."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Disimpan di execution context (bukan conn.info), jadi statement yang
+        # gagal tidak meninggalkan sisa: context-nya ikut dibuang.
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        db_queries.inc()
+        db_query_seconds.observe(elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+            if stats.statements is not None:
+                stats.statements.append((statement, elapsed))
+
+
+def log_slow_request(method: str, path: str, status_code: int, elapsed: float, stats):
+    """Cetak request lambat dengan SQL termahal (dikelompokkan, supaya N+1 kelihatan)."""
+    grouped: Dict[str, list] = {}
+    for statement, seconds in stats.statements:
+        entry = grouped.setdefault(" ".join(statement.split()), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+    print(
+        f"[SLOW] {method} {path} {status_code} {elapsed * 1000:.0f}ms, "
+        f"{stats.queries} query ({stats.db_seconds * 1000:.0f}ms SQL)"
+    )
+    top = sorted(grouped.items(), key=lambda item: item[1][1], reverse=True)[:5]
+    for statement, (count, seconds) in top:
+        print(f"    {seconds * 1000:8.1f}ms x{count:<4} {statement[:300]}")
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: latency dan jumlah query per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(record_statements=SLOW_REQUEST_SECONDS > 0)
+        token = _request_stats.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            # Pakai template path (mis. /chapters/{chapter_id}/content), bukan path asli
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            http_requests.labels(method, route, str(status_code)).inc()
+            http_request_seconds.labels(method, route).observe(elapsed)
+            http_request_queries.labels(method, route).observe(stats.queries)
+            http_request_db_seconds.labels(method, route).observe(stats.db_seconds)
+            if SLOW_REQUEST_SECONDS > 0 and elapsed >= SLOW_REQUEST_SECONDS:
+                log_slow_request(method, scope["path"], status_code, elapsed, stats)
+
+
+# --- ADMISSION CONTROL ---
+class AdmissionRejected(HTTPException):
+    """Panggilan AI ditolak sebelum dikirim; client sebaiknya coba lagi nanti."""
+
+    def __init__(self, retry_after: float, detail: str):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+
+BucketSpec = namedtuple("BucketSpec", ["key", "cost", "capacity", "per_second"])
+
+
+def refill_bucket(tokens: float, updated_at: float, now: float, spec: BucketSpec) -> float:
+    # ``now`` bisa sedikit lebih tua dari updated_at milik worker lain
+    return min(spec.capacity, tokens + max(0.0, now - updated_at) * spec.per_second)
+
+
+def bucket_wait(tokens: float, spec: BucketSpec) -> float:
+    """Detik sampai bucket punya cukup token untuk ``spec.cost`` (0 = cukup sekarang)."""
+    cost = min(spec.cost, spec.capacity)
+    return 0.0 if tokens >= cost else (cost - tokens) / spec.per_second
+
+
+class MemoryBucketStore:
+    """Token bucket in-process: cukup untuk deployment satu worker."""
+
+    runs_in_threadpool = False
+
+    def __init__(self):
+        self._buckets: Dict[str, tuple] = {}
+
+    def take_all(self, specs: List[BucketSpec]) -> float:
+        """Ambil token dari semua bucket sekaligus, atau tidak sama sekali.
+
+        Return 0 jika berhasil, selain itu detik tunggu terlama.
+        """
+        now = time.time()
+        levels = [
+            refill_bucket(*self._buckets.get(spec.key, (spec.capacity, now)), now, spec)
+            for spec in specs
+        ]
+        wait = max(bucket_wait(tokens, spec) for tokens, spec in zip(levels, specs))
+        for tokens, spec in zip(levels, specs):
+            taken = 0 if wait else min(spec.cost, spec.capacity)
+            self._buckets[spec.key] = (tokens - taken, now)
+        return wait
+
+
+def is_lock_conflict(error: OperationalError) -> bool:
+    """Deadlock / lock wait timeout (MySQL 1213/1205) atau SQLite yang sedang dikunci."""
+    code = error.orig.args[0] if getattr(error.orig, "args", None) else None
+    return code in (1205, 1213) or "database is locked" in str(error.orig)
+
+
+class DBBucketStore:
+    """Token bucket di tabel ``rate_limit_buckets``, dibagi semua worker.
+
+    Token diambil dengan satu UPDATE bersyarat per bucket (isi ulang lalu
+    kurangi, hanya jika cukup), jadi atomik tanpa ``SELECT ... FOR UPDATE``
+    yang diabaikan SQLite dan memicu gap lock/deadlock di MySQL untuk key
+    yang belum ada. Baris bucket baru dibuat dengan insert-ignore.
+    """
+
+    runs_in_threadpool = True
+    max_attempts = 5
+
+    def take_all(self, specs: List[BucketSpec]) -> float:
+        # Urutan key tetap supaya dua transaksi tidak saling mengunci silang
+        specs = sorted(specs, key=lambda spec: spec.key)
+        attempt = 0
+        while True:
+            db = SessionLocal()
+            try:
+                wait = self._take_once(db, specs)
+                if wait is not None:
+                    return wait
+            except OperationalError as e:
+                db.rollback()
+                attempt += 1
+                if attempt >= self.max_attempts or not is_lock_conflict(e):
+                    raise
+                time.sleep(0.01 * attempt)
+            finally:
+                db.close()
+
+    def _take_once(self, db: Session, specs: List[BucketSpec]) -> Optional[float]:
+        """0 jika berhasil, detik tunggu jika token kurang, None jika perlu diulang."""
+        now = time.time()
+        for spec in specs:
+            cost = min(spec.cost, spec.capacity)
+            # ``now`` bisa sedikit lebih tua dari updated_at tulisan worker lain
+            behind = RateLimitBucket.updated_at < now
+            elapsed = case((behind, now - RateLimitBucket.updated_at), else_=0.0)
+            refilled = RateLimitBucket.tokens + elapsed * spec.per_second
+            refilled = case((refilled > spec.capacity, spec.capacity), else_=refilled)
+            result = db.execute(
+                update(RateLimitBucket)
+                .where(RateLimitBucket.key == spec.key, refilled >= cost)
+                # MySQL mengevaluasi SET dari kiri: tokens dihitung sebelum updated_at berubah
+                .ordered_values(
+                    (RateLimitBucket.tokens, refilled - cost),
+                    (RateLimitBucket.updated_at, case((behind, now), else_=RateLimitBucket.updated_at)),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 0:
+                break
+        else:
+            db.commit()
+            return 0.0
+
+        # Ada bucket yang belum ada atau tokennya kurang: batalkan semua
+        db.rollback()
+        rows = {
+            row.key: row
+            for row in db.query(
+                RateLimitBucket.key, RateLimitBucket.tokens, RateLimitBucket.updated_at
+            ).filter(RateLimitBucket.key.in_([spec.key for spec in specs]))
+        }
+        missing = [spec for spec in specs if spec.key not in rows]
+        if missing:
+            self._create_buckets(db, missing, now)
+            return None
+        wait = max(
+            bucket_wait(
+                refill_bucket(rows[spec.key].tokens, rows[spec.key].updated_at, now, spec),
+                spec,
+            )
+            for spec in specs
+        )
+        # 0 berarti token sudah terisi lagi sejak UPDATE tadi: coba lagi
+        return wait or None
+
+    @staticmethod
+    def _create_buckets(db: Session, specs: List[BucketSpec], now: float):
+        try:
+            db.execute(
+                insert(RateLimitBucket)
+                .prefix_with("IGNORE", dialect="mysql")
+                .prefix_with("OR IGNORE", dialect="sqlite"),
+                [
+                    {"key": spec.key, "tokens": spec.capacity, "updated_at": now}
+                    for spec in specs
+                ],
+            )
+            db.commit()
+        except IntegrityError:
+            # Dialek lain tanpa insert-ignore: worker lain sudah membuatnya
+            db.rollback()
+
+
+class CircuitBreaker:
+    """Buka setelah ``threshold`` ResourceExhausted berturut-turut.
+
+    Selama terbuka semua panggilan langsung ditolak. Setelah ``cooldown``
+    satu panggilan percobaan diizinkan; sukses menutup breaker lagi.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return "closed"
+        return "open" if self.open_until > time.monotonic() else "half-open"
+
+    def allow(self) -> float:
+        """0 jika panggilan boleh jalan, selain itu detik sampai boleh dicoba lagi."""
+        if self.failures < self.threshold:
+            return 0.0
+        remaining = self.open_until - time.monotonic()
+        if remaining > 0:
+            return remaining
+        if self.trial_in_flight:
+            return 1.0
+        self.trial_in_flight = True
+        return 0.0
+
+    def cancel_trial(self):
+        self.trial_in_flight = False
+
+    def record(self, exhausted: bool):
+        self.trial_in_flight = False
+        if not exhausted:
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.open_until = time.monotonic() + self.cooldown
+
+
+class AdmissionController:
+    """Gerbang sebelum setiap panggilan AI.
+
+    Urutan: circuit breaker -> bucket per user (langsung ditolak jika habis)
+    -> bucket global RPM/TPM. Jika bucket global kosong, request menunggu di
+    antrian terbatas yang dilayani round-robin antar user, jadi satu user
+    yang spam tidak bisa menyerobot antrian user lain.
+    """
+
+    def __init__(
+        self,
+        store,
+        rpm: int,
+        tpm: int,
+        user_rpm: int,
+        max_waiters: int,
+        max_wait: float,
+        breaker: CircuitBreaker,
+    ):
+        self.store = store
+        self.rpm = rpm
+        self.tpm = tpm
+        self.user_rpm = user_rpm
+        self.max_waiters = max_waiters
+        self.max_wait = max_wait
+        self.breaker = breaker
+        self.rejected = 0
+        # user -> antrian (future, cost) miliknya, urutan dict = giliran round-robin
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def _global_specs(self, cost: int) -> List[BucketSpec]:
+        return [
+            BucketSpec("global:rpm", 1, self.rpm, self.rpm / 60),
+            BucketSpec("global:tpm", cost, self.tpm, self.tpm / 60),
+        ]
+
+    async def _take(self, specs: List[BucketSpec]) -> float:
+        if self.store.runs_in_threadpool:
+            return await run_in_threadpool(self.store.take_all, specs)
+        return self.store.take_all(specs)
+
+    def _reject(self, retry_after: float, detail: str) -> AdmissionRejected:
+        self.rejected += 1
+        return AdmissionRejected(retry_after, detail)
+
+    async def acquire(self, user_key: str, cost: int):
+        retry_after = self.breaker.allow()
+        if retry_after:
+            raise self._reject(retry_after, "Kuota AI habis. Tunggu sebentar.")
+        try:
+            user_spec = BucketSpec(f"user:{user_key}", 1, self.user_rpm, self.user_rpm / 60)
+            wait = await self._take([user_spec])
+            if wait:
+                raise self._reject(wait, "Terlalu banyak permintaan AI. Coba lagi nanti.")
+
+            if not self._waiting:
+                wait = await self._take(self._global_specs(cost))
+                if not wait:
+                    return
+                if wait > self.max_wait:
+                    raise self._reject(wait, "Server AI sedang penuh. Coba lagi nanti.")
+            if self.queue_depth >= self.max_waiters:
+                raise self._reject(wait or 1, "Antrian AI penuh. Coba lagi nanti.")
+
+            future = asyncio.get_running_loop().create_future()
+            self._waiting.setdefault(user_key, deque()).append((future, cost))
+            if self._dispatcher is None or self._dispatcher.done():
+                self._dispatcher = asyncio.create_task(self._dispatch())
+            try:
+                await asyncio.wait_for(future, timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                raise self._reject(self.max_wait, "Server AI sedang penuh. Coba lagi nanti.")
+        except BaseException:
+            self.breaker.cancel_trial()
+            raise
+
+    async def _dispatch(self):
+        while self._waiting:
+            user_key, waiters = next(iter(self._waiting.items()))
+            future, cost = waiters[0]
+            if not future.done():
+                wait = await self._take(self._global_specs(cost))
+                if wait:
+                    await asyncio.sleep(min(wait, 1.0))
+                    continue
+                if not future.done():
+                    future.set_result(None)
+            waiters.popleft()
+            # Giliran pindah ke user berikutnya
+            del self._waiting[user_key]
+            if waiters:
+                self._waiting[user_key] = waiters
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "rejected": self.rejected,
+            "breaker": self.breaker.state,
+        }
+
+
+def estimate_tokens(text: str) -> int:
+    # Perkiraan kasar ~4 karakter per token, cukup untuk bucket TPM
+    return len(text) // 4 + 1
+
+
+admission = AdmissionController(
+    store=DBBucketStore() if RATE_LIMIT_BACKEND == "db" else MemoryBucketStore(),
+    rpm=LLM_RPM,
+    tpm=LLM_TPM,
+    user_rpm=LLM_USER_RPM,
+    max_waiters=LLM_QUEUE_MAX_WAITERS,
+    max_wait=LLM_QUEUE_MAX_WAIT_SECONDS,
+    breaker=CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN_SECONDS),
+)
+
+
+# --- LLM CLIENT ---
+class ModelBackend(Protocol):
+    """Yang dipakai ``LLMClient`` dari model; ``genai.GenerativeModel`` memenuhinya.
+
+    Balasan punya ``.text`` (dan opsional ``.usage_metadata``). Dengan
+    ``stream=True`` balasannya async iterable berisi potongan seperti itu.
+    """
 
-# Validasi agar tidak crash kalau lupa isi .env
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY belum diset di file .env!")
+    async def generate_content_async(
+        self, prompt: str, stream: bool = False, generation_config: Optional[dict] = None
+    ): ...
 
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel("gemini-flash-latest")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class LLMClient:
+    """Pembungkus async untuk model AI.
+
+    Memakai ``generate_content_async`` dari SDK supaya event loop tidak
+    terblokir, dengan batas waktu per panggilan dan batas konkurensi.
+    Setiap panggilan melewati ``admission`` lebih dulu.
+
+    Model dibuat oleh ``model_factory`` di thread terpisah saat ``start()``
+    (atau saat panggilan pertama), bukan saat import.
+    """
+
+    def __init__(
+        self,
+        model_factory: Callable[[], ModelBackend],
+        timeout: float,
+        max_concurrency: int,
+        admission: AdmissionController,
+    ):
+        self.model = None
+        self.model_factory = model_factory
+        self.timeout = timeout
+        self.admission = admission
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._model_ready: Optional[asyncio.Future] = None
+
+    def start(self):
+        """Mulai membuat model di background tanpa menahan startup app."""
+        if self.model is None and self._model_ready is None:
+            self._model_ready = asyncio.ensure_future(
+                run_in_threadpool(self.model_factory)
+            )
+
+    async def _get_model(self):
+        if self.model is None:
+            self.start()
+            ready = self._model_ready
+            try:
+                self.model = await asyncio.shield(ready)
+            finally:
+                # Kalau gagal, panggilan berikutnya mencoba membuat model lagi
+                if ready.done() and self._model_ready is ready:
+                    self._model_ready = None
+        return self.model
+
+    async def _admit(self, kind: str, prompt: str, user_key: str):
+        cost = estimate_tokens(prompt) + LLM_RESPONSE_TOKENS_ESTIMATE
+        started = time.perf_counter()
+        try:
+            await self.admission.acquire(user_key, cost)
+        except AdmissionRejected:
+            llm_requests.labels(kind, "rejected").inc()
+            raise
+        finally:
+            llm_admission_seconds.observe(time.perf_counter() - started)
+
+    @staticmethod
+    def _record(kind: str, outcome: str, started, prompt: str, text: str, usage):
+        llm_requests.labels(kind, outcome).inc()
+        if started is not None:
+            llm_request_seconds.labels(kind).observe(time.perf_counter() - started)
+        if outcome != "ok":
+            return
+        # usage_metadata dari Gemini; perkiraan kasar kalau tidak tersedia
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or estimate_tokens(prompt)
+        response_tokens = getattr(usage, "candidates_token_count", 0) or estimate_tokens(text)
+        llm_tokens.labels(kind, "prompt").inc(prompt_tokens)
+        llm_tokens.labels(kind, "response").inc(response_tokens)
+
+    async def generate(
+        self,
+        prompt: str,
+        user_key: str,
+        generation_config: Optional[dict] = None,
+    ) -> str:
+        model = await self._get_model()
+        await self._admit("generate", prompt, user_key)
+        outcome, started, text, usage = "error", None, "", None
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                response = await asyncio.wait_for(
+                    model.generate_content_async(
+                        prompt, generation_config=generation_config
+                    ),
+                    timeout=self.timeout,
+                )
+            text = response.text
+            usage = getattr(response, "usage_metadata", None)
+            outcome = "ok"
+            return text
+        except ResourceExhausted:
+            outcome = "resource_exhausted"
+            raise
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        finally:
+            self.admission.breaker.record(outcome == "resource_exhausted")
+            self._record("generate", outcome, started, prompt, text, usage)
+
+    async def stream(self, prompt: str, user_key: str) -> AsyncIterator[str]:
+        """Sama seperti ``generate`` tapi mengembalikan potongan teks begitu tiba."""
+        model = await self._get_model()
+        await self._admit("stream", prompt, user_key)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        outcome, started, text, usage = "error", None, "", None
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                response = await asyncio.wait_for(
+                    model.generate_content_async(prompt, stream=True),
+                    timeout=self.timeout,
+                )
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(
+                            chunks.__anext__(), timeout=max(deadline - loop.time(), 0)
+                        )
+                    except StopAsyncIteration:
+                        outcome = "ok"
+                        return
+                    # Chunk terakhir membawa total usage untuk seluruh stream
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    text += chunk.text
+                    yield chunk.text
+        except ResourceExhausted:
+            outcome = "resource_exhausted"
+            raise
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise
+        finally:
+            self.admission.breaker.record(outcome == "resource_exhausted")
+            self._record("stream", outcome, started, prompt, text, usage)
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeModel:
+    """Model palsu deterministik: tanpa jaringan dan tanpa kuota Gemini.
+
+    Balasan dipilih dari ``response_schema`` yang diminta (silabus, konten
+    chapter, kuis, daftar bab) dan selalu sama; ``text``/``stream_text``
+    memaksa balasan tertentu. Mode streaming mengirim ``chunk_size``
+    karakter per potongan dengan total jeda ``latency`` detik. Dengan
+    ``exhausted_every=N`` setiap panggilan ke-N gagal dengan ``ResourceExhausted``.
+    """
+
+    MARKDOWN = "# Materi Contoh\n\n" + "\n\n".join(
+        f"## Bagian {n}\n\nVariabel itu ibarat wadah makanan: diberi label lalu diisi. "
+        "Kita coba bayangkan bersama bagaimana datanya mengalir.\n\n"
+        "| Fitur | Penjelasan |\n|---|---|\n| Kecepatan | Sangat cepat |"
+        for n in range(1, 9)
+    )
+    QUIZZES = [
+        {"question": "1 + 1?", "options": ["1", "2", "3", "4"], "correct_answer": "2"},
+        {
+            "question": "Wadah data disebut?",
+            "options": ["Variabel", "Loop"],
+            "correct_answer": "Variabel",
+        },
+    ]
+    CHAPTERS = [
+        {"chapter_number": n, "title": f"Bab {n}", "summary": f"Ringkasan bab {n}"}
+        for n in range(1, 5)
+    ]
+
+    def __init__(
+        self,
+        latency: float = 1.0,
+        text: Optional[str] = None,
+        stream_text: Optional[str] = None,
+        chunk_size: int = 16,
+        exhausted_every: int = 0,
+    ):
+        self.latency = latency
+        self.text = text
+        self.stream_text = stream_text
+        self.chunk_size = chunk_size
+        self.exhausted_every = exhausted_every
+        self.calls = 0
+
+    def reply(self, generation_config: Optional[dict]) -> str:
+        schema = (generation_config or {}).get("response_schema")
+        if schema is ChapterContent:
+            return json.dumps({"content_markdown": self.MARKDOWN, "quizzes": self.QUIZZES})
+        if schema == list[QuizItem]:
+            return json.dumps(self.QUIZZES)
+        if schema == list[SyllabusChapter]:
+            return json.dumps(self.CHAPTERS)
+        return json.dumps(
+            {
+                "title": "Kursus Contoh",
+                "description": "Kursus dari model palsu",
+                "chapters": self.CHAPTERS,
+            }
+        )
+
+    async def generate_content_async(
+        self,
+        prompt: str,
+        stream: bool = False,
+        generation_config: Optional[dict] = None,
+        **kwargs,
+    ):
+        self.calls += 1
+        if self.exhausted_every and self.calls % self.exhausted_every == 0:
+            raise ResourceExhausted("Kuota model palsu habis")
+        if stream:
+            return self._stream()
+        await asyncio.sleep(self.latency)
+        return FakeResponse(self.text or self.reply(generation_config))
+
+    async def _stream(self):
+        text = self.stream_text or (
+            f"{self.MARKDOWN}\n{STREAM_QUIZ_MARKER}\n{json.dumps(self.QUIZZES)}"
+        )
+        pieces = [
+            text[i : i + self.chunk_size] for i in range(0, len(text), self.chunk_size)
+        ]
+        for piece in pieces:
+            await asyncio.sleep(self.latency / len(pieces))
+            yield FakeResponse(piece)
+
+
+def create_gemini_model() -> ModelBackend:
+    # SDK Gemini berat diimport (~0.8 detik), jadi baru diimport saat model dibuat
+    import google.generativeai as genai
+
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+
+def create_fake_model() -> ModelBackend:
+    return FakeModel(
+        latency=FAKE_LLM_LATENCY_SECONDS, exhausted_every=FAKE_LLM_EXHAUSTED_EVERY
+    )
+
+
+MODEL_BACKENDS: Dict[str, Callable[[], ModelBackend]] = {
+    "gemini": create_gemini_model,
+    "fake": create_fake_model,
+}
+if LLM_BACKEND not in MODEL_BACKENDS:
+    raise ValueError(f"LLM_BACKEND harus salah satu dari: {', '.join(MODEL_BACKENDS)}")
+
+llm = LLMClient(
+    MODEL_BACKENDS[LLM_BACKEND],
+    timeout=LLM_TIMEOUT_SECONDS,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    admission=admission,
+)
+
+# Engine dibuat di lifespan (``init_db``); SessionLocal baru terikat setelah itu
+engine = None
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
 
+def init_db():
+    """Buat engine + pool koneksi untuk worker ini (sekali saja)."""
+    global engine
+    if engine is None:
+        engine = create_engine(
+            SQLALCHEMY_DATABASE_URL,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+        instrument_engine(engine)
+        SessionLocal.configure(bind=engine)
+    return engine
+
+
 # --- MODELS ---
 class User(Base):
     __tablename__ = "users"
@@ -56,11 +963,17 @@ class Course(Base):
     description = Column(Text)
     user_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="courses")
-    chapters = relationship("Chapter", back_populates="course")
+    chapters = relationship(
+        "Chapter", back_populates="course", order_by="Chapter.chapter_number"
+    )
 
 
 class Chapter(Base):
     __tablename__ = "chapters"
+    # Dipakai unlock chapter berikutnya dan urutan chapter di outline
+    __table_args__ = (
+        Index("ix_chapters_course_id_chapter_number", "course_id", "chapter_number"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     course_id = Column(Integer, ForeignKey("courses.id"))
     chapter_number = Column(Integer)
@@ -69,14 +982,107 @@ class Chapter(Base):
     is_locked = Column(Boolean, default=True)
     is_completed = Column(Boolean, default=False)
     content_json = Column(Text, nullable=True)
+    # Diisi sekali bersama content_json, supaya read path tidak perlu encode ulang
+    content_etag = Column(String(66), nullable=True)
+    content_gzip = Column(LargeBinary, nullable=True)
+    content_br = Column(LargeBinary, nullable=True)
     course = relationship("Course", back_populates="chapters")
 
 
-Base.metadata.create_all(bind=engine)
+def utcnow() -> datetime:
+    """Waktu UTC tanpa tzinfo, sesuai kolom DateTime (naive) di tabel-tabel ini."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LLMCacheEntry(Base):
+    """Respons AI yang sudah divalidasi, dipakai ulang lintas user."""
+
+    __tablename__ = "llm_cache"
+    key = Column(String(64), primary_key=True)
+    template = Column(String(50))
+    response_json = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+
+class RateLimitBucket(Base):
+    """Token bucket admission control yang dibagi antar worker."""
+
+    __tablename__ = "rate_limit_buckets"
+    key = Column(String(100), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+
+class ChapterGenerationClaim(Base):
+    """Penanda bahwa satu worker sedang generate konten sebuah chapter."""
+
+    __tablename__ = "chapter_generation_claims"
+    chapter_id = Column(Integer, ForeignKey("chapters.id"), primary_key=True)
+    claimed_at = Column(DateTime, nullable=False)
+
+
+def create_schema():
+    """Buat/migrasi skema. Dijalankan eksplisit: ``python main.py init-db``.
+
+    ``create_all`` hanya membuat tabel yang belum ada, jadi kolom nullable
+    dan index yang ditambahkan ke tabel lama di-ALTER di sini. Aman
+    dijalankan berulang kali.
+    """
+    engine = init_db()
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        quote = conn.dialect.identifier_preparer.quote
+        existing = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            columns = {column["name"] for column in existing.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(
+                        f"Kolom NOT NULL {table.name}.{column.name} harus dimigrasi manual"
+                    )
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {quote(table.name)} "
+                    f"ADD COLUMN {quote(column.name)} {column_type}"
+                )
+                print(f"Kolom {table.name}.{column.name} ditambahkan")
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+    # Konten lama (sebelum kolom kompresi ada) diisi sekali di sini
+    session = SessionLocal()
+    try:
+        while True:
+            rows = (
+                session.query(Chapter.id, Chapter.content_json)
+                .filter(Chapter.content_json.isnot(None), Chapter.content_etag.is_(None))
+                .limit(100)
+                .all()
+            )
+            if not rows:
+                break
+            for chapter_id, content_json in rows:
+                session.execute(
+                    update(Chapter)
+                    .where(Chapter.id == chapter_id)
+                    .values(encode_chapter_content(content_json))
+                )
+            session.commit()
+            print(f"{len(rows)} konten chapter dikompresi")
+    finally:
+        session.close()
+
 
 # --- SECURITY ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt"
+)
 
 
 def get_db():
@@ -87,19 +1093,82 @@ def get_db():
         db.close()
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)
-):
+class CurrentUser(BaseModel):
+    """User yang sedang login, cukup untuk endpoint (tanpa objek ORM)."""
+
+    id: int
+    username: str
+
+
+class UserCache:
+    """Cache user per id dengan TTL pendek, supaya auth tidak query DB tiap request.
+
+    LRU berukuran ``max_items``; entri kedaluwarsa dibuang saat dibaca.
+    """
+
+    def __init__(self, ttl: float, max_items: int):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._users: "OrderedDict[int, tuple]" = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[CurrentUser]:
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, user: CurrentUser):
+        self._users[user.id] = (time.monotonic() + self.ttl, user)
+        self._users.move_to_end(user.id)
+        while len(self._users) > self.max_items:
+            self._users.popitem(last=False)
+
+
+user_cache = UserCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_ITEMS)
+
+
+def create_access_token(user: CurrentUser) -> str:
+    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    payload = {"sub": user.username, "uid": user.id, "exp": expire}
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+async def run_password_hashing(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, func, *args)
+
+
+def _load_user(user_id: int) -> Optional[CurrentUser]:
+    db = SessionLocal()
+    try:
+        row = db.query(User.id, User.username).filter(User.id == user_id).first()
+        return CurrentUser(id=row.id, username=row.username) if row else None
+    finally:
+        db.close()
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> CurrentUser:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        user_id: int = payload.get("uid")
+        # Token lama (tanpa uid/exp) tidak diterima lagi: user harus login ulang
+        if username is None or user_id is None or "exp" not in payload:
             raise HTTPException(status_code=401)
     except JWTError:
         raise HTTPException(status_code=401, detail="Credential invalid")
 
-    user = db.query(User).filter(User.username == username).first()
+    user = user_cache.get(user_id)
     if user is None:
+        user = await run_in_threadpool(_load_user, user_id)
+        if user is None:
+            raise HTTPException(status_code=401)
+        user_cache.put(user)
+    if user.username != username:
         raise HTTPException(status_code=401)
     return user
 
@@ -135,8 +1204,775 @@ class CourseResponse(BaseModel):
     chapters: List[ChapterBase]
 
 
+class QuizItem(BaseModel):
+    question: str
+    options: List[str]
+    correct_answer: str
+
+
+# Skema output terstruktur AI (dipakai sebagai response_schema Gemini)
+class SyllabusChapter(BaseModel):
+    chapter_number: int
+    title: str
+    summary: str
+
+
+class Syllabus(BaseModel):
+    title: str
+    description: str
+    chapters: List[SyllabusChapter]
+
+
+class ChapterContent(BaseModel):
+    content_markdown: str
+    quizzes: List[QuizItem]
+
+
+class ChapterOutline(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    chapter_number: int
+    title: str
+    is_locked: bool
+    is_completed: bool
+
+
+class CourseOutline(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    title: str
+    description: str
+    chapters: List[ChapterOutline]
+
+
+# --- KOMPRESI KONTEN CHAPTER ---
+def encode_chapter_content(content_json: str) -> dict:
+    """Hitung ETag dan versi terkompresi konten, untuk disimpan di tabel chapters."""
+    raw = content_json.encode()
+    return {
+        Chapter.content_json: content_json,
+        Chapter.content_etag: make_etag(raw),
+        Chapter.content_gzip: gzip.compress(raw, compresslevel=9, mtime=0),
+        Chapter.content_br: brotli.compress(raw) if brotli is not None else None,
+    }
+
+
+def negotiate_encoding(request: Request) -> Optional[str]:
+    """Pilih encoding terbaik yang diterima client: br > gzip > tanpa kompresi."""
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+# --- LLM CACHE ---
+class LLMCache:
+    """Cache respons AI berbasis isi prompt: LRU in-process di depan tabel DB.
+
+    Key = hash dari template prompt, input yang dinormalisasi, dan nama model,
+    jadi "Python Dasar" dan "python  dasar" berbagi satu entri.
+    """
+
+    # Prune tabel tiap sekian kali simpan, bukan di setiap simpan
+    PRUNE_EVERY = 50
+
+    def __init__(self, ttl: float, memory_items: int, max_rows: int):
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.max_rows = max_rows
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._puts = 0
+        self.hits_memory = 0
+        self.hits_db = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(template: str, prompt_fn: Callable[..., str], **inputs: str) -> str:
+        # Render template dengan placeholder: perubahan teks prompt = key baru
+        template_text = prompt_fn(**{name: f"{{{name}}}" for name in inputs})
+        normalized = {name: " ".join(str(value).split()).casefold() for name, value in inputs.items()}
+        payload = json.dumps(
+            {
+                "template": template,
+                "template_hash": hashlib.sha256(template_text.encode()).hexdigest(),
+                "inputs": normalized,
+                # Respons model palsu tidak boleh tercampur dengan respons Gemini
+                "model": GEMINI_MODEL if LLM_BACKEND == "gemini" else LLM_BACKEND,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is not None and entry[0] > time.time():
+            self._memory.move_to_end(key)
+            self.hits_memory += 1
+            return entry[1]
+
+        row = await run_in_threadpool(self._db_get, key)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits_db += 1
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    async def put(self, key: str, template: str, response_json: str):
+        self._remember(key, response_json, time.time() + self.ttl)
+        self._puts += 1
+        prune = self._puts % self.PRUNE_EVERY == 0
+        await run_in_threadpool(self._db_put, key, template, response_json, prune)
+
+    def stats(self) -> dict:
+        hits = self.hits_memory + self.hits_db
+        total = hits + self.misses
+        return {
+            "hits_memory": self.hits_memory,
+            "hits_db": self.hits_db,
+            "misses": self.misses,
+            "hit_ratio": hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+    def _remember(self, key: str, response_json: str, expires_at: float):
+        self._memory[key] = (expires_at, response_json)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _db_get(self, key: str):
+        """Return (response_json, expires_at epoch) atau None jika tidak ada/kedaluwarsa."""
+        db = SessionLocal()
+        try:
+            entry = db.get(LLMCacheEntry, key)
+            if entry is None:
+                return None
+            expires_at = entry.created_at + timedelta(seconds=self.ttl)
+            if expires_at <= utcnow():
+                db.delete(entry)
+                db.commit()
+                return None
+            return entry.response_json, time.time() + (
+                expires_at - utcnow()
+            ).total_seconds()
+        finally:
+            db.close()
+
+    def _db_put(self, key: str, template: str, response_json: str, prune: bool):
+        db = SessionLocal()
+        try:
+            entry = db.get(LLMCacheEntry, key) or LLMCacheEntry(key=key)
+            entry.template = template
+            entry.response_json = response_json
+            entry.created_at = utcnow()
+            db.add(entry)
+            db.commit()
+            if prune:
+                self._db_prune(db)
+        except IntegrityError:
+            # Worker lain menyimpan key yang sama duluan; isinya setara
+            db.rollback()
+        finally:
+            db.close()
+
+    def _db_prune(self, db: Session):
+        expired_before = utcnow() - timedelta(seconds=self.ttl)
+        db.query(LLMCacheEntry).filter(LLMCacheEntry.created_at < expired_before).delete(
+            synchronize_session=False
+        )
+        # Batas ukuran: buang entri tertua yang melebihi max_rows
+        cutoff = (
+            db.query(LLMCacheEntry.created_at)
+            .order_by(LLMCacheEntry.created_at.desc())
+            .offset(self.max_rows)
+            .limit(1)
+            .scalar()
+        )
+        if cutoff is not None:
+            db.query(LLMCacheEntry).filter(LLMCacheEntry.created_at <= cutoff).delete(
+                synchronize_session=False
+            )
+        db.commit()
+
+
+llm_cache = LLMCache(
+    ttl=LLM_CACHE_TTL_SECONDS,
+    memory_items=LLM_CACHE_MEMORY_ITEMS,
+    max_rows=LLM_CACHE_MAX_ROWS,
+)
+
+
+# --- OUTPUT TERSTRUKTUR AI ---
+def json_output(schema) -> dict:
+    """Mode JSON Gemini: output dipaksa mengikuti skema Pydantic ``schema``.
+
+    Untuk array pakai ``list[Model]``; SDK tidak bisa membaca ``typing.List``.
+    """
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+def extract_json(raw_text: str, brackets: str = "{}"):
+    """Parse JSON dari output AI, toleran terhadap teks/```json di sekelilingnya."""
+    start_index = raw_text.find(brackets[0])
+    end_index = raw_text.rfind(brackets[1])
+    if start_index == -1 or end_index == -1:
+        raise ValueError("AI tidak memberikan format JSON yang valid.")
+    return json.loads(raw_text[start_index : end_index + 1])
+
+
+def valid_items(items, schema) -> list:
+    """Item list yang lolos validasi ``schema``; item yang rusak dibuang."""
+    if not isinstance(items, list):
+        return []
+    valid = []
+    for item in items:
+        try:
+            valid.append(schema.model_validate(item))
+        except ValidationError:
+            continue
+    return valid
+
+
+class GenerationStats:
+    """Hitung berapa generasi AI terbuang per respons yang berhasil."""
+
+    def __init__(self):
+        self.successes = 0
+        self.full_regenerations = 0
+        self.partial_repairs = 0
+
+    def stats(self) -> dict:
+        return {
+            "successes": self.successes,
+            "full_regenerations": self.full_regenerations,
+            "partial_repairs": self.partial_repairs,
+            "wasted_per_success": (
+                self.full_regenerations / self.successes if self.successes else 0.0
+            ),
+        }
+
+
+generation_stats = GenerationStats()
+
+
+def quiz_prompt(content_markdown: str) -> str:
+    return f"""
+        Buat 1 sampai 3 soal kuis pilihan ganda (Bahasa Indonesia) yang relevan
+        dengan materi berikut. "correct_answer" WAJIB sama persis dengan salah satu "options".
+
+        Materi:
+        {content_markdown}
+        """
+
+
+async def complete_quizzes(raw_quizzes, content_markdown: str, user_key: str) -> list:
+    """Validasi kuis dari AI; kalau tidak ada yang valid, buat ulang kuisnya saja.
+
+    Materi markdown (bagian terbesar output) tetap dipakai, jadi perbaikan
+    jauh lebih murah daripada generasi ulang satu chapter penuh.
+    """
+    quizzes = valid_items(raw_quizzes, QuizItem)
+    if not quizzes:
+        generation_stats.partial_repairs += 1
+        raw_text = await llm.generate(
+            quiz_prompt(content_markdown),
+            user_key,
+            generation_config=json_output(list[QuizItem]),
+        )
+        quizzes = valid_items(extract_json(raw_text, "[]"), QuizItem)
+        if not quizzes:
+            raise ValueError("Kuis dari AI tidak valid")
+    return [quiz.model_dump() for quiz in quizzes]
+
+
+# --- GENERASI KONTEN CHAPTER (SINGLE-FLIGHT) ---
+# Penanda antara markdown dan JSON kuis pada output mode streaming
+STREAM_QUIZ_MARKER = "===KUIS==="
+
+
+class ChapterStream:
+    """Delta markdown dari satu generasi streaming, dibagikan ke semua subscriber."""
+
+    def __init__(self):
+        self.deltas: List[str] = []
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def publish(self, delta: str):
+        self.deltas.append(delta)
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        # Subscriber yang telat tetap mendapat semua delta dari awal
+        index = 0
+        while True:
+            while index < len(self.deltas):
+                yield self.deltas[index]
+                index += 1
+            if self.closed:
+                return
+            await self._changed.wait()
+
+
+# Generasi yang sedang berjalan di worker ini, per chapter id
+_chapter_generations: Dict[int, "asyncio.Task[dict]"] = {}
+_chapter_streams: Dict[int, ChapterStream] = {}
+
+
+def chapter_prompt_intro(course_title: str, chapter_title: str) -> str:
+    """Instruksi materi + kuis yang sama untuk mode biasa maupun streaming."""
+    # --- PROMPT DIPERBARUI UNTUK MULTI-KUIS ---
+    return f"""
+        Bertindaklah sebagai Mentor Coding yang asik, ramah, dan interaktif (seperti teman mengajar teman).
+
+        Topik Kursus: "{course_title}"
+        Bab Saat Ini: "{chapter_title}".
+
+        Instruksi Konten:
+        1.  **Gaya Bahasa:** Gunakan Bahasa Indonesia yang santai, tidak kaku, dan mudah dipahami pemula. Hindari definisi buku teks yang membosankan.
+        2.  **Analogi:** WAJIB gunakan analogi dunia nyata untuk menjelaskan konsep teknis (misal: "Variable itu ibarat wadah makanan...").
+        3.  **Interaktif:** Sapa pembaca, ajak mereka membayangkan sesuatu.
+        4.  **Format Tabel:** JIKA menjelaskan perbandingan (misal: Kelebihan vs Kekurangan, Tipe A vs Tipe B), WAJIB gunakan format Markdown Table yang valid.
+
+        Contoh Tabel Markdown yang diharapkan:
+        | Fitur | Penjelasan |
+        |---|---|
+        | Kecepatan | Sangat Cepat |
+
+        Instruksi Kuis:
+        Buat 1 sampai 3 soal kuis pilihan ganda yang relevan dengan materi di atas.
+"""
+
+
+async def generate_chapter_content(
+    course_title: str, chapter_title: str, user_key: str
+) -> dict:
+    """Panggil AI untuk membuat materi + kuis satu chapter.
+
+    Output memakai mode JSON dengan skema ``ChapterContent``. Kalau hanya
+    kuisnya yang rusak, yang dibuat ulang cuma kuisnya; generasi penuh
+    diulang hanya kalau materinya sendiri tidak bisa dipakai.
+    """
+    prompt = chapter_prompt_intro(course_title, chapter_title) + """
+        Output: "content_markdown" berisi materi lengkap dengan format markdown
+        (heading, bold, list, tabel) dan "quizzes" berisi daftar kuis.
+        """
+
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        raw_text = await llm.generate(
+            prompt, user_key, generation_config=json_output(ChapterContent)
+        )
+        try:
+            data = extract_json(raw_text)
+            content_markdown = data.get("content_markdown")
+            if not isinstance(content_markdown, str) or not content_markdown.strip():
+                raise ValueError("Materi dari AI kosong")
+        except ValueError:
+            if attempt == LLM_MAX_ATTEMPTS - 1:
+                raise
+            generation_stats.full_regenerations += 1
+            continue
+
+        # Validasi Backward Compatibility (Jaga-jaga kalau AI cuma kasih 1 'quiz')
+        raw_quizzes = data.get("quizzes")
+        if raw_quizzes is None and "quiz" in data:
+            raw_quizzes = [data["quiz"]]
+        quizzes = await complete_quizzes(raw_quizzes, content_markdown, user_key)
+        generation_stats.successes += 1
+        return {"content_markdown": content_markdown, "quizzes": quizzes}
+
+
+async def stream_chapter_content(
+    course_title: str, chapter_title: str, user_key: str, stream: ChapterStream
+) -> dict:
+    """Seperti ``generate_chapter_content`` tapi markdown dipublish per potongan."""
+    prompt = chapter_prompt_intro(course_title, chapter_title) + f"""
+        Format Output (WAJIB, tanpa JSON pembungkus):
+        1. Tulis materi lengkap dalam format markdown (heading, bold, list, tabel).
+        2. Setelah materi selesai, tulis satu baris berisi persis: {STREAM_QUIZ_MARKER}
+        3. Setelah baris itu, tulis HANYA JSON array kuis:
+        [
+            {{
+                "question": "Pertanyaan?",
+                "options": ["A", "B", "C", "D"],
+                "correct_answer": "A"
+            }}
+        ]
+        """
+
+    buffer = ""
+    published = 0
+    marker_index = -1
+    try:
+        async for text in llm.stream(prompt, user_key):
+            buffer += text
+            if marker_index != -1:
+                continue
+            marker_index = buffer.find(STREAM_QUIZ_MARKER)
+            # Tahan ekor buffer yang mungkin awal dari penanda yang terpotong
+            safe_end = (
+                marker_index
+                if marker_index != -1
+                else len(buffer) - len(STREAM_QUIZ_MARKER) + 1
+            )
+            if safe_end > published:
+                stream.publish(buffer[published:safe_end])
+                published = safe_end
+        # Tanpa penanda, seluruh output dianggap materi (kuis dibuat ulang)
+        if marker_index == -1 and published < len(buffer):
+            stream.publish(buffer[published:])
+    finally:
+        stream.close()
+
+    # Materi sudah terkirim ke klien; kuis yang hilang/rusak dibuat ulang saja
+    if marker_index == -1:
+        content_markdown = buffer.strip()
+        raw_quizzes = None
+    else:
+        content_markdown = buffer[:marker_index].strip()
+        try:
+            raw_quizzes = extract_json(
+                buffer[marker_index + len(STREAM_QUIZ_MARKER) :], "[]"
+            )
+        except ValueError:
+            raw_quizzes = None
+    if not content_markdown:
+        raise ValueError("Materi dari AI kosong")
+
+    quizzes = await complete_quizzes(raw_quizzes, content_markdown, user_key)
+    generation_stats.successes += 1
+    return {"content_markdown": content_markdown, "quizzes": quizzes}
+
+
+def _claim_chapter_generation(chapter_id: int) -> bool:
+    """Ambil klaim generasi di DB. False jika worker lain sedang memegangnya."""
+    db = SessionLocal()
+    try:
+        # Klaim basi (worker mati di tengah jalan) boleh diambil alih
+        stale_before = utcnow() - timedelta(seconds=CHAPTER_CLAIM_TTL_SECONDS)
+        db.query(ChapterGenerationClaim).filter(
+            ChapterGenerationClaim.chapter_id == chapter_id,
+            ChapterGenerationClaim.claimed_at < stale_before,
+        ).delete(synchronize_session=False)
+        db.add(ChapterGenerationClaim(chapter_id=chapter_id, claimed_at=utcnow()))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+def _refresh_chapter_claim(chapter_id: int):
+    db = SessionLocal()
+    try:
+        db.query(ChapterGenerationClaim).filter(
+            ChapterGenerationClaim.chapter_id == chapter_id
+        ).update({ChapterGenerationClaim.claimed_at: utcnow()})
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _keep_chapter_claim(chapter_id: int):
+    """Perbarui klaim selama generasi berjalan, supaya tidak dianggap basi.
+
+    Satu generasi bisa melebihi TTL (retry, perbaikan kuis, antrian admission);
+    hanya klaim milik worker yang mati yang boleh kedaluwarsa.
+    """
+    while True:
+        await asyncio.sleep(CHAPTER_CLAIM_TTL_SECONDS / 3)
+        try:
+            await run_in_threadpool(_refresh_chapter_claim, chapter_id)
+        except Exception as e:
+            print(f"Gagal memperbarui klaim chapter {chapter_id}: {e}")
+
+
+def _release_chapter_generation(chapter_id: int):
+    db = SessionLocal()
+    try:
+        db.query(ChapterGenerationClaim).filter(
+            ChapterGenerationClaim.chapter_id == chapter_id
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _load_chapter_for_generation(chapter_id: int):
+    """Return (content_json, course_title, chapter_title, owner_id) atau None."""
+    db = SessionLocal()
+    try:
+        return (
+            db.query(
+                Chapter.content_json,
+                Course.title.label("course_title"),
+                Chapter.title.label("chapter_title"),
+                Course.user_id.label("owner_id"),
+            )
+            .join(Course, Course.id == Chapter.course_id)
+            .filter(Chapter.id == chapter_id)
+            .first()
+        )
+    finally:
+        db.close()
+
+
+def _store_chapter_content(chapter_id: int, content_json: str):
+    db = SessionLocal()
+    try:
+        # Jangan pernah menimpa konten yang sudah ada
+        db.query(Chapter).filter(
+            Chapter.id == chapter_id, Chapter.content_json.is_(None)
+        ).update(encode_chapter_content(content_json), synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _generate_chapter_content_once(
+    chapter_id: int,
+    stream: Optional[ChapterStream] = None,
+    fresh: bool = False,
+    user_key: Optional[str] = None,
+) -> dict:
+    while not await run_in_threadpool(_claim_chapter_generation, chapter_id):
+        # Worker lain sedang generate chapter ini: tunggu hasilnya muncul di DB
+        row = await run_in_threadpool(_load_chapter_for_generation, chapter_id)
+        if row is not None and row.content_json:
+            return json.loads(row.content_json)
+        await asyncio.sleep(CHAPTER_CLAIM_POLL_SECONDS)
+
+    heartbeat = asyncio.create_task(_keep_chapter_claim(chapter_id))
+    try:
+        row = await run_in_threadpool(_load_chapter_for_generation, chapter_id)
+        if row is None:
+            raise ValueError(f"Chapter {chapter_id} tidak ditemukan")
+        if row.content_json:
+            return json.loads(row.content_json)
+
+        # Chapter dengan judul course + judul bab yang sama berbagi konten.
+        # Yang di-cache adalah hasil akhirnya, jadi mode streaming/biasa setara.
+        cache_key = LLMCache.make_key(
+            "chapter_content",
+            chapter_prompt_intro,
+            course_title=row.course_title,
+            chapter_title=row.chapter_title,
+        )
+        cached = None if fresh else await llm_cache.get(cache_key)
+        if cached is not None:
+            data = json.loads(cached)
+            if stream is not None:
+                stream.publish(data["content_markdown"])
+        else:
+            # Kuota AI dibebankan ke user yang meminta; prefetch ke pemilik course
+            if user_key is None:
+                user_key = str(row.owner_id)
+            if stream is not None:
+                data = await stream_chapter_content(
+                    row.course_title, row.chapter_title, user_key, stream
+                )
+            else:
+                data = await generate_chapter_content(
+                    row.course_title, row.chapter_title, user_key
+                )
+            await llm_cache.put(cache_key, "chapter_content", json.dumps(data))
+        await run_in_threadpool(_store_chapter_content, chapter_id, json.dumps(data))
+        return data
+    finally:
+        heartbeat.cancel()
+        await run_in_threadpool(_release_chapter_generation, chapter_id)
+
+
+async def get_or_generate_chapter_content(
+    chapter_id: int, fresh: bool = False, user_key: Optional[str] = None
+) -> dict:
+    """Generate konten chapter, paling banyak satu kali per chapter.
+
+    Request yang datang belakangan menunggu generasi yang sedang berjalan
+    (di worker ini lewat task bersama, di worker lain lewat klaim DB).
+    """
+    # shield: request yang putus tidak membatalkan generasi milik bersama
+    return await asyncio.shield(
+        start_chapter_generation(chapter_id, fresh=fresh, user_key=user_key)
+    )
+
+
+def start_chapter_generation(
+    chapter_id: int,
+    stream: Optional[ChapterStream] = None,
+    fresh: bool = False,
+    user_key: Optional[str] = None,
+) -> "asyncio.Task[dict]":
+    """Mulai generasi chapter, atau kembalikan task yang sudah berjalan.
+
+    ``stream``, ``fresh`` dan ``user_key`` (yang menanggung kuota AI; None =
+    pemilik course) hanya dipakai jika generasi baru benar-benar dimulai di sini.
+    """
+    task = _chapter_generations.get(chapter_id)
+    if task is None:
+        task = asyncio.create_task(
+            _generate_chapter_content_once(chapter_id, stream, fresh, user_key)
+        )
+        _chapter_generations[chapter_id] = task
+        if stream is not None:
+            _chapter_streams[chapter_id] = stream
+
+        def _forget(_):
+            _chapter_generations.pop(chapter_id, None)
+            _chapter_streams.pop(chapter_id, None)
+            if stream is not None:
+                stream.close()
+
+        task.add_done_callback(_forget)
+    return task
+
+
+# --- PREFETCH KONTEN CHAPTER ---
+class ChapterPrefetcher:
+    """Antrian + worker pool yang mengisi ``content_json`` sebelum dibuka user.
+
+    ``enqueue`` aman dipanggil dari endpoint sync (threadpool).
+    """
+
+    def __init__(self, workers: int, max_retries: int, backoff: float):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional["asyncio.Queue[int]"] = None
+        self._pending: set = set()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    def enqueue(self, chapter_id: int):
+        if self._loop is None or not self._tasks:
+            return
+        self._loop.call_soon_threadsafe(self._put, chapter_id)
+
+    def _put(self, chapter_id: int):
+        if chapter_id in self._pending:
+            return
+        self._pending.add(chapter_id)
+        self._queue.put_nowait(chapter_id)
+
+    async def _worker(self):
+        while True:
+            chapter_id = await self._queue.get()
+            try:
+                await self._prefetch(chapter_id)
+            finally:
+                self._pending.discard(chapter_id)
+                self._queue.task_done()
+
+    async def _prefetch(self, chapter_id: int):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await get_or_generate_chapter_content(chapter_id)
+                return
+            except (ResourceExhausted, AdmissionRejected) as e:
+                if attempt == self.max_retries:
+                    print(f"Prefetch chapter {chapter_id} menyerah: kuota AI habis")
+                    return
+                delay = self.backoff * 2**attempt
+                await asyncio.sleep(max(delay, getattr(e, "retry_after", 0)))
+            except Exception as e:
+                print(f"Error prefetch chapter {chapter_id}: {e}")
+                return
+
+    def stats(self) -> dict:
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return {
+            "workers": len(self._tasks),
+            "queue_depth": queued,
+            "in_progress": len(self._pending) - queued,
+        }
+
+
+chapter_prefetcher = ChapterPrefetcher(
+    workers=PREFETCH_WORKERS,
+    max_retries=PREFETCH_MAX_RETRIES,
+    backoff=PREFETCH_BACKOFF_SECONDS,
+)
+
+
+# --- HTTP CACHING (ETAG) ---
+# Konten chapter tidak pernah berubah setelah digenerate
+CHAPTER_CONTENT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# Outline course berubah saat chapter selesai/terbuka: selalu revalidasi
+COURSE_OUTLINE_CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def not_modified(etag: str, cache_control: str, vary: Optional[str] = None) -> Response:
+    # 304 wajib membawa header yang sama dengan 200-nya (ETag, Cache-Control, Vary)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if vary is not None:
+        headers["Vary"] = vary
+    return Response(status_code=304, headers=headers)
+
+
 # --- APP ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Engine dan model AI dibuat per worker di sini, bukan saat import
+    if LLM_BACKEND == "gemini" and llm.model is None and not GOOGLE_API_KEY:
+        raise ValueError("GOOGLE_API_KEY belum diset di file .env!")
+    init_db()
+    llm.start()
+    await chapter_prefetcher.start()
+    yield
+    await chapter_prefetcher.stop()
+    engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -148,70 +1984,151 @@ app.add_middleware(
 
 
 @app.post("/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    hashed_pw = pwd_context.hash(user.password)
-    existing_user = db.query(User).filter(User.username == user.username).first()
+async def register(user: UserCreate, db: Session = Depends(get_db)):
+    # Cek duplikat dulu: jangan buang waktu bcrypt untuk username yang sudah ada
+    existing_user = await run_in_threadpool(
+        lambda: db.query(User.id).filter(User.username == user.username).first()
+    )
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already registered")
+    await run_in_threadpool(db.close)
+    hashed_pw = await run_password_hashing(pwd_context.hash, user.password)
     db_user = User(username=user.username, password_hash=hashed_pw)
     db.add(db_user)
-    db.commit()
+    try:
+        await run_in_threadpool(db.commit)
+    except IntegrityError:
+        # Username sama didaftarkan bersamaan oleh request lain
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=400, detail="Username already registered")
     return {"msg": "User created"}
 
 
 @app.post("/token")
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
 ):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not pwd_context.verify(form_data.password, user.password_hash):
+    user = await run_in_threadpool(
+        lambda: db.query(User.id, User.username, User.password_hash)
+        .filter(User.username == form_data.username)
+        .first()
+    )
+    # Koneksi DB tidak dipegang selama verifikasi bcrypt
+    await run_in_threadpool(db.close)
+    if not user or not await run_password_hashing(
+        pwd_context.verify, form_data.password, user.password_hash
+    ):
         raise HTTPException(status_code=400, detail="Incorrect username or password")
-    token = jwt.encode({"sub": user.username}, SECRET_KEY, algorithm=ALGORITHM)
+    current_user = CurrentUser(id=user.id, username=user.username)
+    user_cache.put(current_user)
+    token = create_access_token(current_user)
     return {"access_token": token, "token_type": "bearer"}
 
 
-@app.post("/generate-preview")
-async def generate_preview(request: CourseCreate):
-    # Prompt kita pertajam agar outputnya lebih bersih
-    prompt = f"""
+def syllabus_prompt(topic: str) -> str:
+    # Struktur JSON dipaksa lewat response_schema (lihat ``generate_syllabus``)
+    return f"""
     Bertindaklah sebagai ahli kurikulum.
-    Buat silabus kursus untuk topik: "{request.topic}".
+    Buat silabus kursus untuk topik: "{topic}".
     Bahasa: Indonesia.
 
-    Output WAJIB HANYA JSON VALID (tanpa markdown ```json atau teks pembuka).
-    Struktur JSON:
-    {{
-        "title": "Judul Menarik",
-        "description": "Deskripsi singkat 1 kalimat",
-        "chapters": [
-            {{
-                "chapter_number": 1,
-                "title": "Judul Bab",
-                "summary": "Ringkasan materi"
-            }}
-        ]
-    }}
+    "title" berisi judul yang menarik, "description" deskripsi singkat 1 kalimat,
+    dan "chapters" berisi daftar bab (nomor, judul, ringkasan materi).
     Syarat: Buat 3-5 Bab.
     """
 
-    try:
-        response = model.generate_content(prompt)
-        raw_text = response.text
 
-        # --- LOGIC PEMBERSIH JSON (ANTI-CRASH) ---
-        # Cari kurung kurawal '{' pertama dan '}' terakhir
-        start_index = raw_text.find("{")
-        end_index = raw_text.rfind("}")
+def syllabus_chapters_prompt(topic: str, title: str) -> str:
+    return f"""
+    Bertindaklah sebagai ahli kurikulum.
+    Buat 3-5 bab untuk kursus "{title}" dengan topik: "{topic}".
+    Bahasa: Indonesia. Setiap bab berisi nomor, judul, dan ringkasan materi.
+    """
 
-        if start_index != -1 and end_index != -1:
-            json_str = raw_text[start_index : end_index + 1]
-            return json.loads(json_str)
-        else:
+
+async def generate_syllabus(topic: str, user_key: str) -> dict:
+    """Minta silabus ke AI dalam mode JSON dengan skema ``Syllabus``.
+
+    Bab yang rusak dibuang; kalau tidak ada bab yang valid, hanya daftar
+    babnya yang dibuat ulang. Generasi penuh diulang hanya jika JSON-nya
+    sendiri tidak bisa dibaca.
+    """
+    prompt = syllabus_prompt(topic)
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        raw_text = await llm.generate(
+            prompt, user_key, generation_config=json_output(Syllabus)
+        )
+        try:
+            data = extract_json(raw_text)
+        except ValueError:
             print(f"AI Output Error (Raw): {raw_text}")
-            raise ValueError("AI tidak memberikan format JSON yang valid.")
+            if attempt == LLM_MAX_ATTEMPTS - 1:
+                raise
+            generation_stats.full_regenerations += 1
+            continue
+        break
+
+    repaired = False
+    title = data.get("title")
+    if not isinstance(title, str) or not title.strip():
+        title, repaired = topic, True
+    description = data.get("description")
+    if not isinstance(description, str):
+        description, repaired = "", True
+
+    chapters = valid_items(data.get("chapters"), SyllabusChapter)
+    if not chapters:
+        raw_text = await llm.generate(
+            syllabus_chapters_prompt(topic, title),
+            user_key,
+            generation_config=json_output(list[SyllabusChapter]),
+        )
+        chapters = valid_items(extract_json(raw_text, "[]"), SyllabusChapter)
+        if not chapters:
+            raise ValueError("Daftar bab dari AI tidak valid")
+        repaired = True
+    elif len(chapters) != len(data["chapters"]):
+        repaired = True
+
+    if repaired:
+        generation_stats.partial_repairs += 1
+    generation_stats.successes += 1
+    # Nomor bab diurutkan ulang supaya tetap rapat setelah bab rusak dibuang
+    for number, chapter in enumerate(chapters, start=1):
+        chapter.chapter_number = number
+    return Syllabus(
+        title=title, description=description, chapters=chapters
+    ).model_dump()
+
+
+@app.post("/generate-preview")
+async def generate_preview(
+    request: CourseCreate,
+    fresh: bool = False,
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    # fresh=true: lewati cache dan minta AI membuat silabus baru
+    cache_key = LLMCache.make_key("syllabus", syllabus_prompt, topic=request.topic)
+    if not fresh:
+        cached = await llm_cache.get(cache_key)
+        if cached is not None:
+            return json.loads(cached)
+
+    try:
+        data = await generate_syllabus(request.topic, str(current_user.id))
+        await llm_cache.put(cache_key, "syllabus", json.dumps(data))
+        return data
 
+    except HTTPException:
+        raise
     except ResourceExhausted:
-        raise HTTPException(status_code=429, detail="Kuota AI habis. Tunggu 1 menit.")
+        raise HTTPException(
+            status_code=429,
+            detail="Kuota AI habis. Tunggu 1 menit.",
+            headers={"Retry-After": "60"},
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="AI terlalu lama merespon.")
     except json.JSONDecodeError:
         raise HTTPException(
             status_code=429, detail="Format AI rusak. Silakan coba lagi."
@@ -225,7 +2142,7 @@ async def generate_preview(request: CourseCreate):
 def save_course(
     course_data: CourseSave,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     new_course = Course(
         title=course_data.title,
@@ -233,155 +2150,376 @@ def save_course(
         user_id=current_user.id,
     )
     db.add(new_course)
-    db.commit()
-    db.refresh(new_course)
-    for idx, ch in enumerate(course_data.chapters):
-        is_locked = False if idx == 0 else True
-        new_chapter = Chapter(
-            course_id=new_course.id,
+    # Satu transaksi: flush untuk id course, lalu semua chapter dalam satu INSERT
+    db.flush()
+    course_id = new_course.id
+    chapters = [
+        ChapterBase(
             chapter_number=ch.chapter_number,
             title=ch.title,
             summary=ch.summary,
-            is_locked=is_locked,
+            is_locked=idx != 0,
+        )
+        for idx, ch in enumerate(course_data.chapters)
+    ]
+    first_chapter_id = None
+    if chapters:
+        db.execute(
+            insert(Chapter),
+            [{"course_id": course_id, **ch.model_dump()} for ch in chapters],
+        )
+        # chapter_number dari client belum tentu unik; bab pertama = id terkecil
+        first_chapter_id = (
+            db.query(Chapter.id)
+            .filter(Chapter.course_id == course_id)
+            .order_by(Chapter.id)
+            .limit(1)
+            .scalar()
         )
-        db.add(new_chapter)
     db.commit()
-    return new_course
+    if first_chapter_id is not None:
+        chapter_prefetcher.enqueue(first_chapter_id)
+    return CourseResponse(
+        id=course_id,
+        title=course_data.title,
+        description=course_data.description,
+        chapters=chapters,
+    )
+
+
+# Kolom yang dibutuhkan outline saja: content_json & summary tidak pernah di-load
+COURSE_OUTLINE_OPTIONS = (
+    load_only(Course.id, Course.title, Course.description),
+    selectinload(Course.chapters).load_only(
+        Chapter.id,
+        Chapter.course_id,
+        Chapter.chapter_number,
+        Chapter.title,
+        Chapter.is_locked,
+        Chapter.is_completed,
+    ),
+)
 
 
-@app.get("/my-courses")
+@app.get("/my-courses", response_model=List[CourseOutline])
 def get_my_courses(
-    db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    courses = db.query(Course).filter(Course.user_id == current_user.id).all()
-    result = []
-    for c in courses:
-        chapters = (
-            db.query(Chapter)
-            .filter(Chapter.course_id == c.id)
-            .order_by(Chapter.chapter_number)
-            .all()
-        )
-        result.append(
-            {
-                "id": c.id,
-                "title": c.title,
-                "description": c.description,
-                "chapters": [
-                    {
-                        "id": ch.id,
-                        "chapter_number": ch.chapter_number,
-                        "title": ch.title,
-                        "is_locked": ch.is_locked,
-                        "is_completed": ch.is_completed,
-                    }
-                    for ch in chapters
-                ],
-            }
-        )
-    return result
+    # 2 query total (courses + semua chapter-nya), bukan 1 + N
+    return (
+        db.query(Course)
+        .options(*COURSE_OUTLINE_OPTIONS)
+        .filter(Course.user_id == current_user.id)
+        .all()
+    )
 
 
-@app.get("/chapters/{chapter_id}/content")
-def get_chapter_content(
-    chapter_id: int,
+@app.get("/courses/{course_id}", response_model=CourseOutline)
+def get_course(
+    course_id: int,
+    request: Request,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    chapter = db.query(Chapter).filter(Chapter.id == chapter_id).first()
-    if not chapter:
+    course = (
+        db.query(Course)
+        .options(*COURSE_OUTLINE_OPTIONS)
+        .filter(Course.id == course_id, Course.user_id == current_user.id)
+        .first()
+    )
+    if not course:
         raise HTTPException(status_code=404)
 
-    if chapter.content_json:
-        return json.loads(chapter.content_json)
-
-    course = db.query(Course).filter(Course.id == chapter.course_id).first()
-
-    # --- PROMPT DIPERBARUI UNTUK MULTI-KUIS ---
-    prompt = f"""
-        Bertindaklah sebagai Mentor Coding yang asik, ramah, dan interaktif (seperti teman mengajar teman).
-
-        Topik Kursus: "{course.title}"
-        Bab Saat Ini: "{chapter.title}".
+    body = CourseOutline.model_validate(course).model_dump_json().encode()
+    etag = make_etag(body)
+    if etag_matches(request, etag):
+        return not_modified(etag, COURSE_OUTLINE_CACHE_CONTROL)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": COURSE_OUTLINE_CACHE_CONTROL},
+    )
 
-        Instruksi Konten:
-        1.  **Gaya Bahasa:** Gunakan Bahasa Indonesia yang santai, tidak kaku, dan mudah dipahami pemula. Hindari definisi buku teks yang membosankan.
-        2.  **Analogi:** WAJIB gunakan analogi dunia nyata untuk menjelaskan konsep teknis (misal: "Variable itu ibarat wadah makanan...").
-        3.  **Interaktif:** Sapa pembaca, ajak mereka membayangkan sesuatu.
-        4.  **Format Tabel:** JIKA menjelaskan perbandingan (misal: Kelebihan vs Kekurangan, Tipe A vs Tipe B), WAJIB gunakan format Markdown Table yang valid.
 
-        Contoh Tabel Markdown yang diharapkan:
-        | Fitur | Penjelasan |
-        |---|---|
-        | Kecepatan | Sangat Cepat |
-
-        Instruksi Kuis:
-        Buat 1 sampai 3 soal kuis pilihan ganda yang relevan dengan materi di atas.
+@app.get("/chapters/{chapter_id}/content")
+async def get_chapter_content(
+    chapter_id: int,
+    request: Request,
+    fresh: bool = False,
+    generate: bool = True,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    encoding = negotiate_encoding(request)
+    stored_column = {"br": Chapter.content_br, "gzip": Chapter.content_gzip}.get(
+        encoding, Chapter.content_json
+    )
+    # Query DB tetap sync, jadi dijalankan di threadpool agar event loop bebas.
+    # Hanya satu representasi konten yang di-load, sesuai Accept-Encoding.
+    row = await run_in_threadpool(
+        lambda: db.query(Chapter.content_json.isnot(None), Chapter.content_etag, stored_column)
+        .filter(Chapter.id == chapter_id)
+        .first()
+    )
+    if not row:
+        raise HTTPException(status_code=404)
 
-        Output WAJIB JSON Valid (tanpa markdown ```json):
-        {{
-            "content_markdown": "Materi lengkap dengan format markdown (heading, bold, list, tabel)...",
-            "quizzes": [
-                {{
-                    "question": "Pertanyaan?",
-                    "options": ["A", "B", "C", "D"],
-                    "correct_answer": "A"
-                }}
-            ]
-        }}
-        """
+    has_content, etag, body = row
+    if not has_content and not generate:
+        # Belum ada konten: client (halaman chapter) lanjut ke endpoint stream
+        return Response(status_code=204, headers={"Cache-Control": "no-store"})
+    if not has_content:
+        # Lepas koneksi DB selama menunggu AI supaya pool tidak habis
+        await run_in_threadpool(db.close)
+        try:
+            data = await get_or_generate_chapter_content(
+                chapter_id, fresh=fresh, user_key=str(current_user.id)
+            )
+        except HTTPException:
+            raise
+        except ResourceExhausted:
+            raise HTTPException(
+                status_code=429,
+                detail="Kuota AI habis. Tunggu 1 menit.",
+                headers={"Retry-After": "60"},
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="AI terlalu lama merespon.")
+        except Exception as e:
+            print(f"Error AI: {e}")
+            # Return fallback error yang aman
+            raise HTTPException(status_code=500, detail="Gagal generate konten.")
+        # Kirim representasi yang baru disimpan, dengan ETag yang sama seperti
+        # request berikutnya, supaya revalidasi pertama langsung dapat 304
+        row = await run_in_threadpool(
+            lambda: db.query(Chapter.content_etag, stored_column)
+            .filter(Chapter.id == chapter_id)
+            .first()
+        )
+        if row is not None and row[0] is not None:
+            etag, body = row
+        else:
+            encoded = await run_in_threadpool(encode_chapter_content, json.dumps(data))
+            etag, body = encoded[Chapter.content_etag], encoded[stored_column]
+    if body is None:
+        # Baris lama tanpa versi terkompresi: kirim JSON mentah apa adanya
+        encoding = None
+        body = await run_in_threadpool(
+            lambda: db.query(Chapter.content_json).filter(Chapter.id == chapter_id).scalar()
+        )
 
+    if isinstance(body, str):
+        body = body.encode()
+    if etag is None:
+        etag = make_etag(body)
+    if encoding is not None:
+        # ETag kuat harus beda per representasi (encoding)
+        etag = f'{etag[:-1]}-{encoding}"'
+    if etag_matches(request, etag):
+        return not_modified(etag, CHAPTER_CONTENT_CACHE_CONTROL, vary="Accept-Encoding")
+
+    # JSON tersimpan sudah valid: kirim bytes langsung, tanpa json.loads/dumps
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CHAPTER_CONTENT_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def chapter_sse_events(
+    chapter_id: int, content_json: Optional[str], fresh: bool, user_key: str
+):
+    if content_json is not None:
+        data = json.loads(content_json)
+        yield sse_event("delta", {"text": data["content_markdown"]})
+        yield sse_event("done", {"quizzes": data.get("quizzes", [])})
+        return
+
+    task = start_chapter_generation(
+        chapter_id, ChapterStream(), fresh=fresh, user_key=user_key
+    )
+    stream = _chapter_streams.get(chapter_id)
+    streamed = False
+    if stream is not None:
+        async for delta in stream.subscribe():
+            streamed = True
+            yield sse_event("delta", {"text": delta})
     try:
-        response = model.generate_content(prompt)
-        raw_text = response.text
-
-        start_index = raw_text.find("{")
-        end_index = raw_text.rfind("}")
-
-        if start_index != -1 and end_index != -1:
-            json_str = raw_text[start_index : end_index + 1]
-            data = json.loads(json_str)
+        # Jika client putus, generator ini dibatalkan tapi task tetap jalan
+        # sampai hasilnya tersimpan di DB
+        data = await asyncio.shield(task)
+    except AdmissionRejected as e:
+        yield sse_event("error", {"detail": e.detail, "retry_after": e.retry_after})
+        return
+    except Exception as e:
+        print(f"Error AI (stream): {e}")
+        yield sse_event("error", {"detail": "Gagal generate konten."})
+        return
+    if not streamed:
+        # Generasi dilakukan tanpa streaming (prefetch / worker lain)
+        yield sse_event("delta", {"text": data["content_markdown"]})
+    yield sse_event("done", {"quizzes": data.get("quizzes", [])})
 
-            # Validasi Backward Compatibility (Jaga-jaga kalau AI cuma kasih 1 'quiz')
-            if "quiz" in data and "quizzes" not in data:
-                data["quizzes"] = [data["quiz"]]
-                del data["quiz"]
 
-            chapter.content_json = json.dumps(data)
-            db.commit()
-            return data
-        else:
-            raise ValueError("Format JSON AI tidak valid")
-
-    except Exception as e:
-        print(f"Error AI: {e}")
-        # Return fallback error yang aman
-        raise HTTPException(status_code=500, detail="Gagal generate konten.")
+@app.get("/chapters/{chapter_id}/content/stream")
+async def stream_chapter_content_sse(
+    chapter_id: int,
+    fresh: bool = False,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    row = await run_in_threadpool(
+        lambda: db.query(Chapter.id, Chapter.content_json)
+        .filter(Chapter.id == chapter_id)
+        .first()
+    )
+    if not row:
+        raise HTTPException(status_code=404)
+    # Koneksi DB tidak dipegang selama streaming
+    await run_in_threadpool(db.close)
+    return StreamingResponse(
+        chapter_sse_events(chapter_id, row.content_json, fresh, str(current_user.id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.put("/chapters/{chapter_id}/complete")
 def complete_chapter(
     chapter_id: int,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    chapter = db.query(Chapter).filter(Chapter.id == chapter_id).first()
+    next_chapter = aliased(Chapter)
+    chapter = (
+        db.query(Chapter.id, next_chapter.id.label("next_id"))
+        .join(Course, Course.id == Chapter.course_id)
+        .outerjoin(
+            next_chapter,
+            and_(
+                next_chapter.course_id == Chapter.course_id,
+                next_chapter.chapter_number == Chapter.chapter_number + 1,
+            ),
+        )
+        # Hanya pemilik course; prefetch bab berikutnya dibebankan ke kuota pemilik
+        .filter(Chapter.id == chapter_id, Course.user_id == current_user.id)
+        .first()
+    )
     if not chapter:
         raise HTTPException(404)
-    chapter.is_completed = True
-    next_chapter = (
-        db.query(Chapter)
-        .filter(
-            Chapter.course_id == chapter.course_id,
-            Chapter.chapter_number == chapter.chapter_number + 1,
+    # Satu UPDATE atomik: tandai bab ini selesai sekaligus buka bab berikutnya
+    db.execute(
+        update(Chapter)
+        .where(Chapter.id.in_([chapter.id, chapter.next_id]))
+        .values(
+            is_completed=case(
+                (Chapter.id == chapter.id, True), else_=Chapter.is_completed
+            ),
+            is_locked=case((Chapter.id == chapter.id, Chapter.is_locked), else_=False),
         )
-        .first()
     )
-    if next_chapter:
-        next_chapter.is_locked = False
     db.commit()
+    if chapter.next_id is not None:
+        chapter_prefetcher.enqueue(chapter.next_id)
     return {"msg": "Chapter completed"}
 
 
+@app.get("/prefetch/status")
+def get_prefetch_status():
+    return chapter_prefetcher.stats()
+
+
+@app.get("/llm-cache/status")
+def get_llm_cache_status():
+    return llm_cache.stats()
+
+
+@app.get("/llm-admission/status")
+def get_llm_admission_status():
+    return admission.stats()
+
+
+@app.get("/llm-generation/status")
+def get_llm_generation_status():
+    return generation_stats.stats()
+
+
+# Komponen yang sudah punya stats() sendiri dibaca saat scrape
+component_metrics.callback(
+    "llm_cache_hits_total",
+    "counter",
+    "Respons AI yang dilayani dari cache",
+    lambda: llm_cache.hits_memory + llm_cache.hits_db,
+)
+component_metrics.callback(
+    "llm_cache_misses_total", "counter", "Lookup cache AI yang miss", lambda: llm_cache.misses
+)
+component_metrics.callback(
+    "llm_cache_hit_ratio",
+    "gauge",
+    "Rasio hit cache AI sejak start",
+    lambda: llm_cache.stats()["hit_ratio"],
+)
+component_metrics.callback(
+    "llm_admission_queue_depth",
+    "gauge",
+    "Panggilan AI yang menunggu admission",
+    lambda: admission.queue_depth,
+)
+component_metrics.callback(
+    "llm_admission_rejected_total",
+    "counter",
+    "Panggilan AI yang ditolak admission",
+    lambda: admission.rejected,
+)
+component_metrics.callback(
+    "llm_breaker_open",
+    "gauge",
+    "1 jika circuit breaker AI tidak closed",
+    lambda: admission.breaker.state != "closed",
+)
+component_metrics.callback(
+    "llm_generation_successes_total",
+    "counter",
+    "Output AI terstruktur yang valid",
+    lambda: generation_stats.successes,
+)
+component_metrics.callback(
+    "llm_full_regenerations_total",
+    "counter",
+    "Generasi AI yang diulang penuh karena JSON rusak",
+    lambda: generation_stats.full_regenerations,
+)
+component_metrics.callback(
+    "llm_partial_repairs_total",
+    "counter",
+    "Output AI yang diperbaiki sebagian",
+    lambda: generation_stats.partial_repairs,
+)
+component_metrics.callback(
+    "prefetch_queue_depth",
+    "gauge",
+    "Chapter yang menunggu di-prefetch",
+    lambda: chapter_prefetcher.stats()["queue_depth"],
+)
+
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Skema tidak lagi dibuat otomatis: jalankan "python main.py init-db" saat deploy
+    if sys.argv[1:] == ["init-db"]:
+        create_schema()
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
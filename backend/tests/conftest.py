@@ -0,0 +1,61 @@
+"""Fixture bersama: database SQLite baru per test dan app yang sudah start.
+
+Model AI selalu palsu (``LLM_BACKEND=fake``), jadi test tidak memakai kuota
+Gemini maupun database sungguhan.
+"""
+
+import os
+from contextlib import asynccontextmanager
+
+# Harus diset sebelum import main (main membaca konfigurasi saat import)
+os.environ.setdefault("GOOGLE_API_KEY", "test-dummy-key")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Limit AI dibuat longgar; test admission memasang limit ketatnya sendiri
+os.environ.setdefault("LLM_RPM", "100000")
+os.environ.setdefault("LLM_USER_RPM", "100000")
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Engine ke file SQLite baru di ``tmp_path``, skema sudah dibuat."""
+    monkeypatch.setattr(main, "SQLALCHEMY_DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(main, "engine", None)
+    engine = main.init_db()
+    main.create_schema()
+    # State in-process yang bisa membawa hasil/id dari database test sebelumnya
+    monkeypatch.setattr(
+        main,
+        "llm_cache",
+        main.LLMCache(
+            ttl=main.LLM_CACHE_TTL_SECONDS,
+            memory_items=main.LLM_CACHE_MEMORY_ITEMS,
+            max_rows=main.LLM_CACHE_MAX_ROWS,
+        ),
+    )
+    user_cache = main.UserCache(main.USER_CACHE_TTL_SECONDS, main.USER_CACHE_MAX_ITEMS)
+    monkeypatch.setattr(main, "user_cache", user_cache)
+    monkeypatch.setattr(main.admission, "store", main.MemoryBucketStore())
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def make_client(database):
+    """Factory ``async with make_client() as client``: lifespan app ikut dijalankan."""
+
+    @asynccontextmanager
+    async def factory():
+        # ASGITransport tidak menjalankan lifespan, jadi dijalankan manual di sini
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                yield client
+
+    return factory
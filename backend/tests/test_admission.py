@@ -0,0 +1,163 @@
+"""Admission control panggilan AI: token bucket, antrian, circuit breaker."""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+
+
+def take_concurrently(store, specs, n):
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        return list(pool.map(lambda _: store.take_all(specs), range(n)))
+
+
+@pytest.mark.usefixtures("database")
+def test_db_bucket_store_concurrent_takes_never_overdraw():
+    store = main.DBBucketStore()
+    # Kapasitas 3, isi ulang sangat lambat: hanya 3 dari 12 yang boleh lolos
+    spec = main.BucketSpec("user:1", 1, 3, 3 / 3600)
+
+    waits = take_concurrently(store, [spec], 12)
+
+    assert waits.count(0) == 3
+    assert all(wait > 0 for wait in waits if wait)
+
+
+@pytest.mark.usefixtures("database")
+def test_db_bucket_store_takes_all_buckets_or_none():
+    store = main.DBBucketStore()
+    user = main.BucketSpec("user:1", 1, 10, 10 / 3600)
+    rpm = main.BucketSpec("global:rpm", 1, 2, 2 / 3600)
+
+    waits = take_concurrently(store, [user, rpm], 6)
+    # Bucket global habis; bucket user tidak boleh ikut terpotong
+    assert waits.count(0) == 2
+    assert store.take_all([user]) == 0
+    db = main.SessionLocal()
+    try:
+        tokens = db.get(main.RateLimitBucket, "user:1").tokens
+    finally:
+        db.close()
+    assert tokens == pytest.approx(10 - 3, abs=0.01)
+
+
+def make_controller(rpm=100000, user_rpm=100000, max_waiters=10, max_wait=5.0, breaker=None):
+    return main.AdmissionController(
+        store=main.MemoryBucketStore(),
+        rpm=rpm,
+        tpm=10**9,
+        user_rpm=user_rpm,
+        max_waiters=max_waiters,
+        max_wait=max_wait,
+        breaker=breaker or main.CircuitBreaker(threshold=3, cooldown=60),
+    )
+
+
+def drain_global(controller):
+    """Habiskan bucket RPM global; token berikutnya baru ada setelah 60/rpm detik."""
+    rpm = controller.rpm
+    controller.store.take_all([main.BucketSpec("global:rpm", rpm, rpm, rpm / 60)])
+
+
+def test_user_over_limit_rejected_with_retry_after():
+    controller = make_controller(user_rpm=2)
+
+    async def scenario():
+        await controller.acquire("a", 1)
+        await controller.acquire("a", 1)
+        with pytest.raises(main.AdmissionRejected) as rejected:
+            await controller.acquire("a", 1)
+        # User lain punya bucket sendiri
+        await controller.acquire("b", 1)
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+
+    assert rejected.status_code == 429
+    # 1 token per 30 detik (2 RPM)
+    assert rejected.retry_after == 30
+    assert rejected.headers["Retry-After"] == "30"
+    assert controller.rejected == 1
+
+
+def test_full_queue_rejects_immediately():
+    controller = make_controller(rpm=60, max_waiters=2)
+
+    async def scenario():
+        drain_global(controller)
+        waiters = [asyncio.create_task(controller.acquire(user, 1)) for user in "ab"]
+        await asyncio.sleep(0)
+        assert controller.queue_depth == 2
+        with pytest.raises(main.AdmissionRejected) as rejected:
+            await controller.acquire("c", 1)
+        for waiter in waiters:
+            waiter.cancel()
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+
+    assert "Antrian AI penuh" in rejected.detail
+
+
+def test_waiter_times_out_after_max_wait():
+    # 1 token per detik: "a" dapat giliran ~1 detik, "b" ~2 detik (> max_wait)
+    controller = make_controller(rpm=60, max_wait=1.5)
+
+    async def scenario():
+        drain_global(controller)
+        return await asyncio.gather(
+            controller.acquire("a", 1), controller.acquire("b", 1), return_exceptions=True
+        )
+
+    first, second = asyncio.run(scenario())
+
+    assert first is None
+    assert isinstance(second, main.AdmissionRejected)
+    assert second.retry_after == 2
+
+
+def test_queue_served_round_robin_between_users():
+    controller = make_controller(rpm=600)
+    served = []
+
+    async def acquire(user):
+        await controller.acquire(user, 1)
+        served.append(user)
+
+    async def scenario():
+        drain_global(controller)
+        # Spammer antri duluan, tapi user lain tidak menunggu semua antriannya
+        await asyncio.gather(*[acquire(user) for user in ["spam", "spam", "spam", "lain"]])
+
+    asyncio.run(scenario())
+
+    assert served == ["spam", "lain", "spam", "spam"]
+
+
+def test_breaker_opens_then_half_open_trial_closes_it():
+    breaker = main.CircuitBreaker(threshold=2, cooldown=0.1)
+    controller = make_controller(breaker=breaker)
+
+    breaker.record(exhausted=True)
+    assert breaker.state == "closed"
+    breaker.record(exhausted=True)
+    assert breaker.state == "open"
+    with pytest.raises(main.AdmissionRejected):
+        asyncio.run(controller.acquire("a", 1))
+
+    time.sleep(0.15)
+    assert breaker.state == "half-open"
+    # Hanya satu panggilan percobaan; yang lain tetap ditolak sampai hasilnya ada
+    assert breaker.allow() == 0
+    assert breaker.allow() > 0
+    breaker.record(exhausted=True)
+    assert breaker.state == "open"
+
+    time.sleep(0.15)
+    asyncio.run(controller.acquire("a", 1))
+    breaker.record(exhausted=False)
+    assert breaker.state == "closed"
+    assert breaker.allow() == 0
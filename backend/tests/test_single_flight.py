@@ -0,0 +1,113 @@
+"""Generasi konten chapter: paling banyak satu panggilan AI per chapter."""
+
+import asyncio
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    model = main.FakeModel(latency=0.2)
+    monkeypatch.setattr(main.llm, "model", model)
+    # Tanpa prefetch, supaya semua panggilan model berasal dari test
+    monkeypatch.setattr(main.chapter_prefetcher, "workers", 0)
+    return model
+
+
+async def new_chapter(client, username):
+    """Register + login lalu buat course baru; return (headers, id bab pertama)."""
+    credentials = {"username": username, "password": "rahasia"}
+    await client.post("/register", json=credentials)
+    token = (await client.post("/token", data=credentials)).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    course = await client.post(
+        "/courses",
+        json={
+            "title": "Kursus Test",
+            "description": "Deskripsi",
+            "chapters": [
+                {"chapter_number": 1, "title": "Bab 1", "summary": "Ringkasan 1"},
+                {"chapter_number": 2, "title": "Bab 2", "summary": "Ringkasan 2"},
+            ],
+        },
+        headers=headers,
+    )
+    outline = (await client.get(f"/courses/{course.json()['id']}", headers=headers)).json()
+    return headers, outline["chapters"][0]["id"]
+
+
+def test_concurrent_requests_generate_once(fake, make_client):
+    async def scenario():
+        async with make_client() as client:
+            headers, chapter_id = await new_chapter(client, "paralel")
+            return await asyncio.gather(
+                *[
+                    client.get(f"/chapters/{chapter_id}/content", headers=headers)
+                    for _ in range(20)
+                ]
+            )
+
+    responses = asyncio.run(scenario())
+
+    assert fake.calls == 1
+    assert {r.status_code for r in responses} == {200}
+    assert len({r.content for r in responses}) == 1
+
+
+def test_workers_share_generation_through_db_claim(fake, make_client):
+    # Dua pemanggilan langsung (tanpa task bersama) mensimulasikan dua worker
+    async def scenario():
+        async with make_client() as client:
+            _, chapter_id = await new_chapter(client, "worker")
+            return await asyncio.gather(
+                main._generate_chapter_content_once(chapter_id, user_key="a"),
+                main._generate_chapter_content_once(chapter_id, user_key="b"),
+            )
+
+    first, second = asyncio.run(scenario())
+
+    assert fake.calls == 1
+    assert first == second
+
+
+def test_claim_outlives_ttl_while_generating(fake, make_client, monkeypatch):
+    fake.latency = 1.0
+    monkeypatch.setattr(main, "CHAPTER_CLAIM_TTL_SECONDS", 0.3)
+
+    async def scenario():
+        async with make_client() as client:
+            _, chapter_id = await new_chapter(client, "lama")
+            running = asyncio.create_task(
+                main._generate_chapter_content_once(chapter_id, user_key="a")
+            )
+            # Lewat dari TTL: klaim harus sudah diperbarui, bukan diambil alih
+            await asyncio.sleep(0.6)
+            late = await main._generate_chapter_content_once(chapter_id, user_key="b")
+            return await running, late
+
+    first, late = asyncio.run(scenario())
+
+    assert fake.calls == 1
+    assert first == late
+
+
+def test_stream_and_plain_request_share_generation(fake, make_client):
+    async def scenario():
+        async with make_client() as client:
+            _, chapter_id = await new_chapter(client, "stream")
+            task = main.start_chapter_generation(
+                chapter_id, main.ChapterStream(), user_key="a"
+            )
+            stream = main._chapter_streams[chapter_id]
+            plain = await main.get_or_generate_chapter_content(chapter_id, user_key="b")
+            deltas = [delta async for delta in stream.subscribe()]
+            return plain, await task, "".join(deltas)
+
+    plain, streamed, markdown = asyncio.run(scenario())
+
+    assert fake.calls == 1
+    assert plain == streamed
+    assert markdown.strip() == streamed["content_markdown"]
+    assert streamed["quizzes"]
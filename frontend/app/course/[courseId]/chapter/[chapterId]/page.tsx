@@ -60,6 +60,8 @@ export default function ChapterPage() {
   const [content, setContent] = useState<ChapterContent | null>(null);
   const [courseData, setCourseData] = useState<CourseStructure | null>(null); // State baru untuk Sidebar
   const [loading, setLoading] = useState(true);
+  // true selama materi masih mengalir dari AI (kuis belum ada)
+  const [streaming, setStreaming] = useState(false);
 
   const [user, setUser] = useState({
     name: "Loading...",
@@ -98,38 +100,99 @@ export default function ChapterPage() {
       });
     }
 
-    fetchData(token);
+    // Batalkan request/stream bab lama saat pindah bab, supaya tidak menimpa halaman baru
+    const controller = new AbortController();
+    fetchData(token, controller.signal);
+    return () => controller.abort();
   }, [chapterId]); // Re-fetch jika pindah bab
 
-  const fetchData = async (token: string) => {
-    setLoading(true);
+  // Konten yang sudah tersimpan diambil dari /content (ETag + gzip/br, cache browser).
+  // Hanya jika belum ada (204) halaman membuka stream supaya materi tampil bertahap.
+  const loadContent = async (token: string, signal: AbortSignal) => {
+    const res = await fetch(
+      `http://localhost:8000/chapters/${chapterId}/content?generate=false`,
+      { headers: { Authorization: `Bearer ${token}` }, signal },
+    );
+    if (res.status === 204) return streamContent(token, signal);
+    if (!res.ok) return;
+    const data = await res.json();
+    if (!signal.aborted) setContent(data);
+  };
+
+  // Baca konten chapter lewat SSE: materi tampil per potongan selagi AI menulis.
+  // Pakai fetch (bukan EventSource) supaya header Authorization tetap terkirim.
+  const streamContent = async (token: string, signal: AbortSignal) => {
+    const res = await fetch(
+      `http://localhost:8000/chapters/${chapterId}/content/stream`,
+      { headers: { Authorization: `Bearer ${token}` }, signal },
+    );
+    if (!res.ok || !res.body) return;
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let markdown = "";
+    setStreaming(true);
     try {
-      // 1. Fetch Konten Chapter
-      const contentRes = await fetch(
-        `http://localhost:8000/chapters/${chapterId}/content`,
-        {
-          headers: { Authorization: `Bearer ${token}` },
-        },
-      );
-      if (contentRes.ok) setContent(await contentRes.json());
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done || signal.aborted) break;
+        buffer += decoder.decode(value, { stream: true });
 
-      // 2. Fetch Struktur Course (Untuk Sidebar & Breadcrumb)
-      // Kita ambil dari /my-courses dan filter (karena endpoint specific course belum tentu ada)
-      const coursesRes = await fetch(`http://localhost:8000/my-courses`, {
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      if (coursesRes.ok) {
-        const courses = await coursesRes.json();
-        const currentCourse = courses.find((c: any) => c.id === courseId);
-        if (currentCourse) setCourseData(currentCourse);
+        // Satu event SSE diakhiri baris kosong
+        let boundary: number;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          const event = rawEvent.match(/^event: (.*)$/m)?.[1];
+          const data = rawEvent.match(/^data: (.*)$/m)?.[1];
+          if (!event || !data || signal.aborted) continue;
+          const payload = JSON.parse(data);
+
+          if (event === "delta") {
+            markdown += payload.text;
+            setContent({ content_markdown: markdown, quizzes: [] });
+            setLoading(false);
+          } else if (event === "done") {
+            setContent({ content_markdown: markdown, quizzes: payload.quizzes });
+          } else if (event === "error") {
+            console.error(payload.detail);
+            if (!markdown) setContent(null);
+            return;
+          }
+        }
       }
+    } finally {
+      if (!signal.aborted) setStreaming(false);
+    }
+  };
 
-      setQuizStatus({});
-      setLockedOptions({});
+  const fetchData = async (token: string, signal: AbortSignal) => {
+    setLoading(true);
+    setStreaming(false);
+    setContent(null);
+    setQuizStatus({});
+    setLockedOptions({});
+    try {
+      await Promise.all([
+        // 1. Konten Chapter
+        loadContent(token, signal),
+        // 2. Fetch Struktur Course (Untuk Sidebar & Breadcrumb)
+        // Cukup outline course ini saja; browser revalidasi via ETag (304 jika tidak berubah)
+        fetch(`http://localhost:8000/courses/${courseId}`, {
+          headers: { Authorization: `Bearer ${token}` },
+          signal,
+        }).then(async (courseRes) => {
+          if (!courseRes.ok) return;
+          const data = await courseRes.json();
+          if (!signal.aborted) setCourseData(data);
+        }),
+      ]);
     } catch (error) {
-      console.error(error);
+      // Pindah bab membatalkan request lama: bukan error
+      if (!signal.aborted) console.error(error);
     } finally {
-      setLoading(false);
+      if (!signal.aborted) setLoading(false);
     }
   };
 
@@ -250,7 +313,7 @@ export default function ChapterPage() {
               </BreadcrumbList>
             </Breadcrumb>
 
-            {!loading && content && totalQuizzes > 0 && (
+            {!loading && !streaming && content && totalQuizzes > 0 && (
               <div className="flex items-center gap-3 w-48 animate-in fade-in">
                 <span className="text-xs text-muted-foreground font-medium whitespace-nowrap">
                   {correctAnswers} / {totalQuizzes} Soal
@@ -378,7 +441,7 @@ export default function ChapterPage() {
             </div>
           </div>
 
-          {!loading && content && (
+          {!loading && !streaming && content && (
             <div className="fixed bottom-6 left-0 right-0 z-50 flex justify-center pointer-events-none px-6 md:pl-[var(--sidebar-width)]">
               <div className="bg-background/80 backdrop-blur-lg border shadow-2xl rounded-2xl p-2 flex items-center gap-4 pointer-events-auto animate-in slide-in-from-bottom-6 duration-500">
                 <div className="px-4 hidden md:block">